@@ -18,12 +18,41 @@ settings = Settings()
 class Bot(commands.Bot):
   async def setup_hook(self):
     from bot.utils.engine import session_maker, create_db
+    from bot.modules import XPLedger, IdentityMap, MessageDeltaStore, Client, HealthMonitor, VoicePresence, Startup, ProfileSync
     self.db_sessionmaker = session_maker
     await create_db()
+    self.identities = IdentityMap(settings.IDENTITY_CACHE_SIZE)
+    self.voice_presence = VoicePresence()
+    self.xp_ledger = XPLedger(session_maker, self.identities, **settings.XP_LEDGER)
+    self.xp_ledger.start()
+    self.message_deltas = MessageDeltaStore(session_maker, **settings.MESSAGE_DELTAS)
+    self.message_deltas.start()
+    self.profiles = ProfileSync(session_maker, **settings.PROFILE_SYNC)
+    self.profiles.start()
+    self.api = Client(**settings.API_CLIENT)
+    self.api_health = HealthMonitor(self.api, **settings.API_HEALTH)
+    self.startup = Startup(**settings.STARTUP)
     for filename in os.listdir('./bot/cogs'):
       if filename.endswith('.py'):
         cog_name = filename[:-3]
         await bot.load_extension(f'bot.cogs.{cog_name}')
+    self.api_health.start()
+
+  async def on_ready(self):
+    await self.startup.run(self.guilds)
+
+  async def close(self):
+    await super().close()
+    if getattr(self, 'xp_ledger', None):
+      await self.xp_ledger.stop()
+    if getattr(self, 'message_deltas', None):
+      await self.message_deltas.stop()
+    if getattr(self, 'profiles', None):
+      await self.profiles.stop()
+    if getattr(self, 'api_health', None):
+      await self.api_health.stop()
+    if getattr(self, 'api', None):
+      await self.api.close()
 
 
 intents = discord.Intents.default()
@@ -35,7 +64,8 @@ intents.reactions = True
 bot = Bot(
   command_prefix=commands.when_mentioned_or('!'),
   description=settings.BOT_DESCR,
-  intents=intents
+  intents=intents,
+  max_messages=settings.MESSAGE_CACHE_SIZE
 )
 
 discord.utils.setup_logging(handler=handler, level=logging.ERROR, formatter=formatter)
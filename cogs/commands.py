@@ -1,11 +1,17 @@
-from discord.ext.commands import Cog, Bot, Context, CooldownMapping, DynamicCooldownMapping, BucketType, Cooldown, check
+from discord.ext.commands import Cog, Bot, Context, CooldownMapping, BucketType, check
+from bot.modules import BoundedCooldownMapping, ConcurrencyLimit, QueueFull, CircuitOpen, BadResponse
 from discord.ext.commands.errors import CommandOnCooldown
 from sqlalchemy.ext.asyncio import AsyncSession
-from bot.modules import Client, check, SafeEval
 from bot.utils.db import with_session
+from discord import Message
+from discord.ext import tasks
+from aiohttp import ClientError
+import asyncio
 from bot.models import Command
-from discord import Message, NotFound
+from bot.utils import setup_logger
+from bot import settings
 
+logger = setup_logger('CommandsSync', filename='bot_commands.log')
 
 
 class CommandsSyncService:
@@ -14,7 +20,12 @@ class CommandsSyncService:
   def __init__(self, bot: Bot):
     self.bot = bot
     self.active_commands = {}
-    self.cooldowns ={}
+    self.fingerprints: dict[str, tuple[str, str]] = {}
+    self.catalog_state: tuple = None
+    self._kept_cooldowns: dict[tuple[str, str], BoundedCooldownMapping] = {} # (uid, fingerprint) -> mapping of a command unregistered while the API is down
+    self.cooldowns: dict[str, BoundedCooldownMapping] = {}
+    self.limits: dict[str, ConcurrencyLimit] = {}
+    self.api_limit = ConcurrencyLimit(**settings.COMMANDS_CONCURRENCY)
     self._cd = CooldownMapping.from_cooldown(1, 60, BucketType.user)
     
   def is_admin():
@@ -24,39 +35,91 @@ class CommandsSyncService:
       return False
     return check(predicate)
     
-  async def retrieve_voice_channel(self, author):
-    try:
-      state = await author.fetch_voice()
-      return bool(state.channel)
-    except NotFound:
-      return False
+  def retrieve_voice_channel(self, author) -> bool:
+    return self.bot.voice_presence.channel(author.id) is not None
+
+  def cooldown_variables(self, ctx: Context) -> dict:
+    identity = self.bot.identities.get(ctx.author.id)
+    return dict(
+      xp_total=identity.xp_total if identity else 0,
+      voice_activity=int(self.retrieve_voice_channel(ctx.author)),
+      voice_duration=self.bot.voice_presence.duration(ctx.author.id),
+    )
+
+  def evict_cooldowns(self) -> int:
+    return sum(mapping.evict() for mapping in self.cooldowns.values())
   
-  async def sync_commands(self, session):
-    commands = await Command.get(session)
-    for cmd in commands:
+  async def sync_commands(self, session) -> tuple[int, int, int]:
+    """ Registers added, re-registers changed and removes deleted commands, returns their counts """
+    self.catalog_state = await Command.catalog_state(session)
+    Command.invalidate_cache()
+    commands = {cmd.uid: cmd for cmd in await Command.get(session)}
+    removed = [uid for uid in self.fingerprints if uid not in commands]
+    for uid in removed:
+      self.unregister_command(self.fingerprints.pop(uid)[0])
+    added = changed = 0
+    for uid, cmd in commands.items():
+      fingerprint = cmd.fingerprint
+      known = self.fingerprints.get(uid)
+      if known and known[1] == fingerprint: continue
+      if known: self.unregister_command(known[0])
       self.bot.remove_command(cmd.name)
       await self.register_command(cmd)
+      self.fingerprints[uid] = (cmd.name, fingerprint)
+      if known: changed += 1
+      else: added += 1
+    self._kept_cooldowns.clear()
+    if added or changed or removed:
+      logger.info(f'Commands synced: {added} added, {changed} changed, {len(removed)} removed')
+    return added, changed, len(removed)
+
+  async def poll_commands(self, session):
+    if await Command.catalog_state(session) != self.catalog_state:
+      await self.sync_commands(session)
+
+  def unregister_command(self, name: str):
+    self.bot.remove_command(name)
+    self.active_commands.pop(name, None)
+    self.cooldowns.pop(name, None)
+    self.limits.pop(name, None)
+
+  def unregister_commands(self):
+    """ Removes every dynamic command, keeping their cooldowns for when the same commands come back """
+    for uid, (name, fingerprint) in self.fingerprints.items():
+      if name in self.cooldowns: self._kept_cooldowns[uid, fingerprint] = self.cooldowns[name]
+    for name in list(self.active_commands):
+      self.unregister_command(name)
+    self.fingerprints.clear()
+    self.catalog_state = None
   
   async def register_command(self, command: Command):
+    limit = ConcurrencyLimit(**command.concurrency_opts, parent=self.api_limit)
     async def dynamic_cmd(ctx: Context, *args):
-      clnt = Client()
       try:
-        vs = await self.retrieve_voice_channel(ctx.author)
-        response = await clnt.ask(*args, **command.params, author=ctx.author.id, voice_activity=vs)
+        vs = self.retrieve_voice_channel(ctx.author)
+        async with limit:
+          response = await self.bot.api.ask(*args, **command.params, **command.cache_opts, author=ctx.author.id, voice_activity=vs)
         return await ctx.reply(str(response.reply))
+      except QueueFull:
+        return await ctx.reply(f'Command {command.name} is busy right now, try again in a moment.')
+      except (CircuitOpen, BadResponse, ClientError, asyncio.TimeoutError):
+        return await ctx.reply(command.fallback_reply)
       except Exception as e:
         print(e)
         return await ctx.reply(f'There was an error performing command {command.name}')
-      finally:
-        await clnt.close()
     
     dynamic_cmd.__name__ = command.name
-    cmd = self.bot.command(**command.cmd_opts)(dynamic_cmd)
+    cooldown = self._kept_cooldowns.pop((command.uid, command.fingerprint), None) or BoundedCooldownMapping.from_formula(
+      command.cooldown or 0, command.cooldown_formula, self.cooldown_variables, **settings.COOLDOWNS
+    )
+    cmd = self.bot.command(**command.cmd_opts, cooldown=cooldown)(dynamic_cmd)
     @cmd.error
     async def cooldown_error(ctx, error):
       if isinstance(error, CommandOnCooldown):
         return await ctx.reply(f'Command is still cooling down! Try again in `{error.retry_after:.1f}s.`')
     self.active_commands[command.name] = dynamic_cmd
+    self.cooldowns[command.name] = cooldown
+    self.limits[command.name] = limit
 
 
 class CommandsSyncCog(Cog):
@@ -64,22 +127,45 @@ class CommandsSyncCog(Cog):
     self.bot = bot
     self.css = CommandsSyncService(bot)
     self.create_commands()
-    self.api_available = False # check()
+    self.evict_cooldowns.start()
+    self.poll_commands.start()
+    self.bot.api_health.on_change(self.api_health_changed)
+    self.bot.startup.add_phase('commands', self.sync_on_ready, per_guild=False)
+
+  async def api_health_changed(self, available: bool):
+    if available:
+      await with_session(self.bot, self.css.sync_commands)
+    else:
+      self.css.unregister_commands()
+
+  def cog_unload(self):
+    self.evict_cooldowns.cancel()
+    self.poll_commands.cancel()
+    self.bot.startup.remove_phase('commands')
+
+  @tasks.loop(seconds=settings.COOLDOWNS['sweep_interval'])
+  async def evict_cooldowns(self):
+    self.css.evict_cooldowns()
+
+  @tasks.loop(seconds=settings.COMMANDS_POLL_INTERVAL)
+  async def poll_commands(self):
+    if not (self.bot.is_ready() and self.bot.api_health.available): return
+    try:
+      await with_session(self.bot, self.css.poll_commands)
+    except Exception:
+      logger.exception('Failed to poll commands') # tasks.loop would stop for good on errors it does not retry
     
-  @Cog.listener()
-  async def on_ready(self):
-    await with_session(self.bot, self.css.sync_commands)
+  async def sync_on_ready(self):
+    if self.bot.api_health.available:
+      await with_session(self.bot, self.css.sync_commands)
     
   def create_commands(self):
     @self.bot.command(name='reload', description="Reloads all dynamic commands")
     async def reload_commands(ctx, *args):
-      await with_session(self.bot, self.css.sync_commands)
-      await ctx.send('All commands have been reloaded!')
+      added, changed, removed = await with_session(self.bot, self.css.sync_commands)
+      await ctx.send(f'Commands reloaded: {added} added, {changed} changed, {removed} removed.')
     
     
 
 async def setup(bot: Bot):
-  if check():
-    await bot.add_cog(CommandsSyncCog(bot))
-  else:
-    print('CommandsSyncCog skipped: API unavailable')
+  await bot.add_cog(CommandsSyncCog(bot))
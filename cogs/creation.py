@@ -3,45 +3,120 @@ from discord.ext.commands import Cog, Bot
 from bot.utils.db import with_session
 from bot.utils import setup_logger
 from bot.models import GuildUser
-from discord import Guild
+from discord import Guild, Member, User
+from typing import AsyncIterator, Iterable
+from bot import settings
 
 logger = setup_logger('BCL', filename='bot_creation.log')
 
 
 class MemberSyncService:
   @staticmethod
-  async def sync_members(session: AsyncSession, _bot: Bot, guild: Guild):
-    existing_members = {user.id: user.uid for user in (await GuildUser.get(session))}
-    for m in guild.members:
-      if not m.bot and m.id not in existing_members:
-        muid = await GuildUser.create_uid(session)
-        new_member = GuildUser(
-          muid, m.created_at, m.id, m.joined_at, m.name, global_name=m.global_name,
-          accent_color=m.accent_color, avatar=m.avatar, avatar_decoration=m.avatar_decoration,
-          avatar_decoration_sku_id=m.avatar_decoration_sku_id, banner=m.banner, color=m.color, premium_since=m.premium_since
-        )
-        await new_member.save(session)
-        logger.info(f'Welcoming new user: {m.global_name}')
-      
+  async def create_member(session: AsyncSession, m: Member) -> GuildUser:
+    muid = await GuildUser.create_uid(session)
+    new_member = GuildUser(
+      muid, m.created_at, m.id, m.joined_at, m.name, global_name=m.global_name,
+      accent_color=m.accent_color, avatar=m.avatar, avatar_decoration=m.avatar_decoration,
+      avatar_decoration_sku_id=m.avatar_decoration_sku_id, banner=m.banner, color=m.color, premium_since=m.premium_since
+    )
+    await new_member.save_unique(session)
+    logger.info(f'Welcoming new user: {m.global_name}')
+    return new_member
+
+  @staticmethod
+  async def _chunks(members: Iterable[Member] | AsyncIterator[Member], size: int):
+    if not hasattr(members, '__aiter__'):
+      for i in range(0, len(members := list(members)), size):
+        yield members[i:i + size]
+      return
+    chunk = []
+    async for m in members:
+      chunk.append(m)
+      if len(chunk) >= size:
+        yield chunk
+        chunk = []
+    if chunk: yield chunk
+
+  @staticmethod
+  async def sync_members(session: AsyncSession, _bot: Bot, guild: Guild, members: Iterable[Member] | AsyncIterator[Member] = None):
+    """ Imports guild members missing from the database in chunked multi-row inserts """
+    if members is None:
+      members = guild.members if guild.chunked else guild.fetch_members(limit=None)
+    existing = {row.id: (row.uid, row.xp_total or 0) for row in await GuildUser.get(session, columns=['id', 'uid', 'xp_total'])}
+    imported = 0
+    async for chunk in MemberSyncService._chunks(members, settings.MEMBER_IMPORT['chunk_size']):
+      rows = {}
+      for m in chunk:
+        if m.bot: continue
+        if m.id in existing:
+          uid, xp_total = existing[m.id]
+          _bot.identities.put(m.id, uid, m.global_name or m.name, xp_total)
+        elif m.id not in rows:
+          rows[m.id] = GuildUser.member_values(None, m)
+      if not rows: continue
+      imported += await GuildUser.insert_many(session, list(rows.values()), settings.MEMBER_IMPORT['chunk_size'], uid='uid')
+      await GuildUser._commit(session)
+      for discord_id, row in rows.items():
+        existing[discord_id] = (row['uid'], 0)
+      GuildUser.on_commit(session, lambda rows=rows: [
+        _bot.identities.put(discord_id, row['uid'], row['global_name'] or row['name']) for discord_id, row in rows.items()
+      ])
+    if imported:
+      logger.info(f'Imported {imported} new members of guild {guild.id}')
+
+  @staticmethod
+  async def member_joined(session: AsyncSession, _bot: Bot, member: Member):
+    if member.bot: return
+    identity = await _bot.identities.resolve(session, member.id)
+    if identity is None:
+      user = await MemberSyncService.create_member(session, member)
+      GuildUser.on_commit(session, lambda: _bot.identities.put(member.id, user.uid, member.global_name or member.name))
+    else:
+      _bot.profiles.record(member.id, GuildUser.profile_values(member))
+
 
 class MemberSyncCog(Cog):
   def __init__(self, bot: Bot):
     self.bot = bot
-    
-  @Cog.listener()
-  async def on_guild_join(self, guild):
+    self.bot.startup.add_phase('members', self.sync_guild)
+
+  def cog_unload(self):
+    self.bot.startup.remove_phase('members')
+
+  async def sync_guild(self, guild: Guild):
     await with_session(
       self.bot, MemberSyncService.sync_members,
       _bot=self.bot, guild=guild
     )
-  
+
+  @Cog.listener()
+  async def on_guild_join(self, guild):
+    await self.sync_guild(guild)
+
+  @Cog.listener()
+  async def on_member_join(self, member: Member):
+    await with_session(
+      self.bot, MemberSyncService.member_joined,
+      _bot=self.bot, member=member
+    )
+
+  def profile_changed(self, before: Member | User, after: Member | User):
+    if after.bot: return
+    if (before.global_name or before.name) != (after.global_name or after.name):
+      self.bot.identities.rename(after.id, after.global_name or after.name)
+    self.bot.profiles.record(after.id, self.bot.profiles.diff(before, after))
+
+  @Cog.listener()
+  async def on_member_update(self, before: Member, after: Member):
+    self.profile_changed(before, after)
+
+  @Cog.listener()
+  async def on_user_update(self, before: User, after: User):
+    self.profile_changed(before, after)
+
   @Cog.listener()
-  async def on_ready(self):
-    for guild in self.bot.guilds:
-      await with_session(
-        self.bot, MemberSyncService.sync_members,
-        _bot=self.bot, guild=guild
-      )
+  async def on_member_remove(self, member: Member):
+    self.bot.identities.discard(member.id)
 
 
 async def setup(bot: Bot):
@@ -1,7 +1,7 @@
 from discord.ext.voice_recv import VoiceData, VoiceRecvClient, BasicSink
 from discord import Message, Member, VoiceState, VoiceChannel, VoiceClient, User, CustomActivity
 from sqlalchemy.ext.asyncio import AsyncSession
-from bot.models import UserWatchDog, GuildUser
+from bot.models import UserWatchDog
 from discord.ext.commands import Cog, Bot
 from bot.utils.db import with_session
 from bot.modules import Record
@@ -21,7 +21,7 @@ class ListeningService:
   
   async def watchdog_joined(self, session: AsyncSession, member: Member, channel: VoiceChannel):
     watchdog = await UserWatchDog.list_column(session, 'uuid', active=True)
-    user = await GuildUser.first(session, id=member.id)
+    user = await self.bot.identities.resolve(session, member.id)
     if not user: return
     if user.uid in watchdog:
       self.r.add_watchdog(member.id)
@@ -52,8 +52,14 @@ class Listening(Cog):
     self.bot = bot
     self.ls = ListeningService(bot)
     
+  @Cog.listener()
+  async def on_ready(self):
+    for guild in self.bot.guilds:
+      self.bot.voice_presence.seed(guild)
+
   @Cog.listener()
   async def on_voice_state_update(self, m: Member, before: VoiceState, after: VoiceState):
+    self.bot.voice_presence.update(m.id, before, after)
     if before.channel != after.channel and after.channel is not None:
       await with_session(self.bot, self.ls.watchdog_joined, member=m, channel=after.channel)
     if after.channel is None and before.channel:
@@ -1,8 +1,5 @@
-from sqlalchemy.ext.asyncio import AsyncSession
-from discord import Message, Reaction, User
-from bot.models import GuildUser, XPHistory
-from bot.modules import MessageAnalyzer
-from bot.utils.db import with_session
+from discord import Message, Reaction, User, RawMessageUpdateEvent, RawMessageDeleteEvent, RawBulkMessageDeleteEvent
+from bot.modules import MessageAnalyzer, XPLedger, MessageDeltaStore
 from discord.ext.commands import Cog
 from bot.utils import setup_logger
 from bot import settings
@@ -13,114 +10,96 @@ logger = setup_logger('MessageXPLogger', filename='bot_messages_xp.log')
 
 
 class ActivityGrantService:
-  @staticmethod
-  async def reaction_added(session: AsyncSession, _author, _reactant):
-    if _author != _reactant:
+  def __init__(self, ledger: XPLedger):
+    self.ledger = ledger
+
+  def reaction_added(self, _author: User, _reactant: User):
+    if _author.id != _reactant.id:
       adelta = settings.XP_BIAS * 2
-      author = await GuildUser.first(session, id=_author)
-      reactant = await GuildUser.first(session, id=_reactant)
-      await author.buff(session, adelta)
-      axph = XPHistory(author.uid, 'Reaction', adelta)
-      await axph.save(session) 
-      logger.info(f'{author.global_name or author.name} gained {adelta} XP')
-      await reactant.buff(session, settings.XP_BIAS)
-      rxph = XPHistory(reactant.uid, 'reaction', settings.XP_BIAS)
-      await rxph.save(session)
-      logger.info(f'{reactant.global_name or reactant.name} gained {settings.XP_BIAS} XP')
+      self.ledger.grant(_author.id, 'reaction', adelta)
+      logger.info(f'{_author.global_name or _author.name} gained {adelta} XP')
+      self.ledger.grant(_reactant.id, 'reaction', settings.XP_BIAS)
+      logger.info(f'{_reactant.global_name or _reactant.name} gained {settings.XP_BIAS} XP')
     
-  @staticmethod
-  async def reaction_removed(session: AsyncSession, _author, _reactant):
-    if _author != _reactant:
+  def reaction_removed(self, _author: User, _reactant: User):
+    if _author.id != _reactant.id:
       adelta = (settings.XP_BIAS * 2) * -1
       rdelta = (settings.XP_BIAS) * -1
-      author = await GuildUser.first(session, id=_author)
-      reactant = await GuildUser.first(session, id=_reactant)
-      await author.buff(session, adelta)
-      axph = XPHistory(author.uid, 'reaction', adelta)
-      await axph.save(session)
-      logger.info(f'{author.global_name or author.name} relinquished {abs(adelta)}')
-      await reactant.buff(session, rdelta)
-      rxph = XPHistory(reactant.uid, 'reaction', rdelta)
-      await rxph.save(session)
-      logger.info(f'{reactant.global_name or reactant.name} relinquished {abs(rdelta)}')
+      self.ledger.grant(_author.id, 'reaction', adelta)
+      logger.info(f'{_author.global_name or _author.name} relinquished {abs(adelta)}')
+      self.ledger.grant(_reactant.id, 'reaction', rdelta)
+      logger.info(f'{_reactant.global_name or _reactant.name} relinquished {abs(rdelta)}')
 
 
 class MessageGrantService:
+  def __init__(self, ledger: XPLedger, store: MessageDeltaStore):
+    self.ledger = ledger
+    self.store = store
 
   @staticmethod
-  def collect_buffs_for_message(message: Message, negative = False) -> tuple[int, int]:
-    ma = MessageAnalyzer(message, settings.PREFIX)
-    data = ma.analyze()
-    all_buffs = [settings.XP_BIAS * settings.XP_MESSAGE_MULTIPLIER[type] for type in data.types]
-    ma.clear()
-    return (data.author, sum(all_buffs) * -1) if negative else (data.author, sum(all_buffs))
+  def collect_buffs_for_message(message: Message) -> tuple[int, int]:
+    data = MessageAnalyzer(message, settings.PREFIX).analyze()
+    all_buffs = [settings.XP_BIAS * settings.XP_MESSAGE_MULTIPLIER.get(type, 0) for type in data.type_names]
+    return data.author, int(sum(all_buffs))
   
-  async def message_added(self, session: AsyncSession, _message: Message):
+  def message_added(self, _message: Message):
     author, delta = self.collect_buffs_for_message(_message)
-    user = await GuildUser.first(session, id=author)
     if delta:
-      await user.buff(session, delta)
-      axph = XPHistory(user.uid, 'message', delta)
-      await axph.save(session)
-      logger.info(f'{user.global_name or user.name} gained {delta} XP')
+      self.store.record(_message.id, author, delta)
+      self.ledger.grant(author, 'message', delta)
+      logger.info(f'{_message.author.global_name or _message.author.name} gained {delta} XP')
 
-  async def message_deleted(self, session: AsyncSession, _message: Message):
-    if not _message: return
-    author, delta = self.collect_buffs_for_message(_message, True)
-    user = await GuildUser.first(session, id=author)
-    if delta:
-      await user.buff(session, delta=delta)
-      axph = XPHistory(user.uid, 'message', delta)
-      await axph.save(session)
-      logger.info(f'{user.global_name or user.name} relinquished {abs(delta)} XP')
+  async def message_deleted(self, message_id: int):
+    entry = await self.store.pop(message_id)
+    if not entry or not entry[1]: return
+    author, delta = entry
+    self.ledger.grant(author, 'message', -delta)
+    logger.info(f'{author} relinquished {abs(delta)} XP')
     
-  async def message_altered(self, session: AsyncSession, _before: Message, _after: Message):
-    author, minus_delta = self.collect_buffs_for_message(_before, True)
-    _, delta = self.collect_buffs_for_message(_after)
-    user = await GuildUser.first(session, id=author)
-    if (minus_delta + delta):
-      await user.buff(session, minus_delta + delta)
-      axph = XPHistory(user.uid, 'message', minus_delta + delta)
-      await axph.save(session)
-      logger.info(f'{user.global_name or user.name} relinquished {abs(delta)} XP')
-      logger.info(f'{user.global_name or user.name} gained {delta} XP')
+  async def message_altered(self, _message: Message):
+    entry = await self.store.get(_message.id)
+    if entry is None and not self.store.tracks(_message.created_at): return
+    previous = entry[1] if entry else 0
+    author, delta = self.collect_buffs_for_message(_message)
+    if delta != previous:
+      self.store.record(_message.id, author, delta)
+      self.ledger.grant(author, 'message', delta - previous)
+      logger.info(f'{_message.author.global_name or _message.author.name} relinquished {abs(previous)} XP')
+      logger.info(f'{_message.author.global_name or _message.author.name} gained {delta} XP')
 
 
 class MessageService(Cog):
   def __init__(self, bot):
     self.bot = bot
-    self.mgs = MessageGrantService()
+    self.mgs = MessageGrantService(bot.xp_ledger, bot.message_deltas)
+    self.ags = ActivityGrantService(bot.xp_ledger)
     
   @Cog.listener()
   async def on_message(self, m: Message):
     if m.author.bot: return
-    await with_session(self.bot, self.mgs.message_added, _message=m)
+    self.mgs.message_added(m)
 
   @Cog.listener()
-  async def on_message_edit(self, before: Message, after: Message):
-    if before.author.bot or after.author.bot: return
-    await with_session(self.bot, self.mgs.message_altered, _before=before, _after=after)
+  async def on_raw_message_edit(self, payload: RawMessageUpdateEvent):
+    if payload.message.author.bot: return
+    await self.mgs.message_altered(payload.message)
     
   @Cog.listener()
-  async def on_message_delete(self, m: Message):
-    if m.author.bot: return
-    await with_session(self.bot, self.mgs.message_deleted, _message=m)
+  async def on_raw_message_delete(self, payload: RawMessageDeleteEvent):
+    await self.mgs.message_deleted(payload.message_id)
+
+  @Cog.listener()
+  async def on_raw_bulk_message_delete(self, payload: RawBulkMessageDeleteEvent):
+    for message_id in payload.message_ids:
+      await self.mgs.message_deleted(message_id)
      
   @Cog.listener()
   async def on_reaction_add(self, reaction: Reaction, user: User):
-    await with_session(
-      self.bot, ActivityGrantService.reaction_added,
-      _author=reaction.message.author.id,
-      _reactant=user.id
-    )
+    self.ags.reaction_added(reaction.message.author, user)
     
   @Cog.listener()
   async def on_reaction_remove(self, reaction: Reaction, user: User):
-    await with_session(
-      self.bot, ActivityGrantService.reaction_removed,
-      _author=reaction.message.author.id,
-      _reactant=user.id
-    )
+    self.ags.reaction_removed(reaction.message.author, user)
     
 
 async def setup(bot):
@@ -7,27 +7,38 @@ from bot.utils.db import with_session
 
 class RoleSyncService:
   
+  @staticmethod
+  async def link_role(_bot: Bot, role_uid: str, role_id: int, guild_id: int):
+    """ Records a guild role in its own short transaction, so it is kept whatever happens to the rest of the sync """
+    async with _bot.db_sessionmaker() as session:
+      await ServerRole(role_uid, role_id, guild_id).save(session)
+
   @staticmethod
   async def sync_roles(session: AsyncSession, _bot: Bot, guild: Guild):
     updated = []
     created = []
     roles = await Role.get(session)
+    linked = set(await ServerRole.list_column(session, 'role_uid', guild_id=guild.id))
+    await session.commit() # read-only so far; don't hold a transaction open across the REST calls below
     existing = {role.name: role for role in guild.roles}
     for role in roles:
       if role.name not in existing:
         perms = Permissions(role.permissions)
         color = Color(int(role.color, 16))
         
+        await _bot.startup.budget.acquire()
         new_role = await guild.create_role(name=role.name, colour=color, permissions=perms, reason=role.reason)
-        sr = ServerRole(role.uid, new_role.id, guild.id)
-        await sr.save(session)
+        await RoleSyncService.link_role(_bot, role.uid, new_role.id, guild.id)
         created.append(role.name)
         continue
       ds_role = existing[role.name]
+      if role.uid not in linked:
+        await RoleSyncService.link_role(_bot, role.uid, ds_role.id, guild.id)
       update_needed = (
         ds_role.permissions.value != role.permissions or ds_role.colour.value != int(role.color, 16)
       )
       if update_needed:
+        await _bot.startup.budget.acquire()
         await ds_role.edit(
           color=Color(int(role.color, 16)), permissions=Permissions(role.permissions), reason='Update'
         )
@@ -37,6 +48,7 @@ class RoleSyncService:
     if len(updated) >= 1: message += f'Обновлены роли: [{",\n".join(updated)}]'
     if message:
       try:
+        await _bot.startup.budget.acquire()
         await guild.system_channel.send(content=message)
       except Forbidden:
         pass
@@ -44,21 +56,20 @@ class RoleSyncService:
 class RoleSyncCog(Cog):
   def __init__(self, bot: Bot):
     self.bot = bot
-    
-  @Cog.listener()
-  async def on_ready(self):
-    for guild in self.bot.guilds:
-      await with_session(
-        self.bot, RoleSyncService.sync_roles,
-        _bot=self.bot, guild=guild
-      )
-      
-  @Cog.listener()
-  async def on_guild_join(self, guild):
+    self.bot.startup.add_phase('roles', self.sync_guild)
+
+  def cog_unload(self):
+    self.bot.startup.remove_phase('roles')
+
+  async def sync_guild(self, guild: Guild):
     await with_session(
       self.bot, RoleSyncService.sync_roles,
       _bot=self.bot, guild=guild
     )
+      
+  @Cog.listener()
+  async def on_guild_join(self, guild):
+    await self.sync_guild(guild)
 
 
 async def setup(bot: Bot):
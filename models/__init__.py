@@ -2,3 +2,5 @@ from .commands import Command
 from .roles import Role, ServerRole
 from .users import GuildUser, UserWatchDog
 from .xp_history import XPHistory
+from .schema_version import SchemaVersion
+from .message_deltas import MessageDelta
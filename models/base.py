@@ -1,12 +1,58 @@
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, selectinload
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, selectinload, Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, inspect, update, text
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from sqlalchemy import select, inspect, update, insert, text, case, tuple_, bindparam, Select, event, or_
 from sqlalchemy import DateTime, Integer, func
 from datetime import datetime as dt, date
+from typing import AsyncIterator
+from functools import lru_cache
+from .cache import EntityCache, CACHES
 import secrets
 import string
 import re
 
+UNIT_OF_WORK = 'unit_of_work' # session.info flag: mutators flush and leave the commit to the session owner
+STALE_MODELS = 'stale_models'
+AFTER_COMMIT = 'after_commit'
+
+
+def run_commit_hooks(session: AsyncSession, committed: bool) -> None:
+  """ Called by the unit-of-work owner once it has committed or rolled back """
+  for callback in session.info.pop(AFTER_COMMIT, ()):
+    if committed: callback()
+
+
+def _snapshot(obj, memo: dict = None):
+  """ Session-free copy of an entity's loaded attributes, including loaded relationships """
+  memo = {} if memo is None else memo
+  if id(obj) in memo: return memo[id(obj)]
+  state = inspect(obj)
+  snap = memo[id(obj)] = (type(obj), {})
+  for attr in state.mapper.attrs:
+    if attr.key not in state.dict: continue
+    value = state.dict[attr.key]
+    if attr.key in state.mapper.relationships:
+      if isinstance(value, (list, set)): value = [_snapshot(v, memo) for v in value]
+      elif value is not None: value = _snapshot(value, memo)
+    snap[1][attr.key] = value
+  return snap
+
+
+def _restore(snap, memo: dict = None):
+  """ Rebuilds a detached entity from a snapshot, ready to be merged into a session """
+  memo = {} if memo is None else memo
+  if id(snap) in memo: return memo[id(snap)]
+  model, values = snap
+  obj = memo[id(snap)] = model._sa_class_manager.new_instance()
+  relationships = inspect(model).relationships
+  for key, value in values.items():
+    if key in relationships:
+      value = [_restore(v, memo) for v in value] if isinstance(value, list) else value and _restore(value, memo)
+    set_committed_value(obj, key, value)
+  make_transient_to_detached(obj)
+  return obj
+
 
 class Base(DeclarativeBase):
   __table_args__ = {
@@ -14,41 +60,165 @@ class Base(DeclarativeBase):
     'mysql_collate': 'utf8mb4_general_ci',
   }
   created: Mapped[dt] = mapped_column(DateTime, default=func.now())
+  UID_ATTEMPTS = 5
+  BULK_CHUNK_SIZE = 1000
+  __cache__ = None # dict(ttl=..., maxsize=...) enables the read-through cache of get/first/list_column
   
   @property
   def created_ts(self):
     return int(self.created.timestamp())
   
-  @classmethod
-  def _build_filters(cls, **filters):
-    simple, exps = {}, []
-    for k, v in filters.items():
-      if '__' in k:
-        field, op = k.split('__', 1)
-        col = getattr(cls, field)
-        if op == 'gte': exps.append(col >= v)
-        elif op == 'lte': exps.append(col <= v)
-        elif op == 'gt': exps.append(col > v)
-        elif op == 'lt': exps.append(col < v)
-        elif op == 'like': exps.append(col.like(v))
-        elif op == 'ilike': exps.append(col.ilike(v))
-        elif op == 'date': exps.append(func.date(col) == v if isinstance(v, date) else date.fromisoformat(v))
-        elif op == 'notnull': exps.append(col.isnot(None))
-        elif op == 'isnull': exps.append(col.is_(None))
+  FILTER_OPS = {
+    'gte': lambda col, p: col >= p,
+    'lte': lambda col, p: col <= p,
+    'gt': lambda col, p: col > p,
+    'lt': lambda col, p: col < p,
+    'like': lambda col, p: col.like(p),
+    'ilike': lambda col, p: col.ilike(p),
+    'date': lambda col, p: func.date(col) == p,
+    'notnull': lambda col, p: col.isnot(None),
+    'isnull': lambda col, p: col.is_(None),
+  }
+  VALUELESS_OPS = {'notnull', 'isnull'}
+
+  @staticmethod
+  @lru_cache(maxsize=512)
+  def _compile(cls, load, columns: tuple, shape: tuple):
+    """ Builds the select for one (model, load, columns, filter keys) shape with a bind parameter per filter value """
+    query = cls._select(list(load) if isinstance(load, tuple) else load, list(columns) if columns else None)
+    clauses = []
+    for i, (key, is_null) in enumerate(shape):
+      field, _, op = key.partition('__')
+      col = getattr(cls, field)
+      if not op:
+        clauses.append(col.is_(None) if is_null else col == bindparam(f'f{i}'))
+      elif op in cls.FILTER_OPS:
+        clauses.append(cls.FILTER_OPS[op](col, bindparam(f'f{i}')))
       else:
-        simple[k] = v
-    return simple, exps
+        raise AttributeError(f'Unsupported filter operator: {op}')
+    return query.where(*clauses) if clauses else query
 
   @classmethod
-  async def get(cls, session: AsyncSession, **filters):
+  def _statement(cls, load=None, columns: list[str] = None, **filters) -> tuple[Select, dict]:
+    keys = sorted(filters)
+    shape = tuple((k, '__' not in k and filters[k] is None) for k in keys)
+    query = Base._compile(cls, tuple(load) if isinstance(load, list) else load, tuple(columns) if columns else None, shape)
+    params = {}
+    for i, (k, is_null) in enumerate(shape):
+      op = k.partition('__')[2]
+      if is_null or op in cls.VALUELESS_OPS: continue
+      v = filters[k]
+      params[f'f{i}'] = v if op != 'date' or isinstance(v, date) else date.fromisoformat(v)
+    return query, params
+
+  @classmethod
+  def _select(cls, load=None, columns: list[str] = None):
+    if columns:
+      return select(*(getattr(cls, c) for c in columns))
     query = select(cls)
-    for rel in inspect(cls).relationships:
-      query = query.options(selectinload(getattr(cls, rel.key)))
-    simple, expressions = cls._build_filters(**filters)
-    query = query.filter_by(**simple) if simple else query.filter(*expressions)
-    result = await session.execute(query)
-    return result.scalars().all()
+    rels = [rel.key for rel in inspect(cls).relationships] if load is True else (load or [])
+    for rel in rels:
+      query = query.options(selectinload(getattr(cls, rel)))
+    return query
+
+  @classmethod
+  def _entity_cache(cls) -> EntityCache | None:
+    if not cls.__cache__: return None
+    cache = CACHES.get(cls)
+    if cache is None:
+      cache = CACHES[cls] = EntityCache(**cls.__cache__)
+    return cache
+
+  @classmethod
+  def invalidate_cache(cls) -> None:
+    """ Drops cached results of this model and of models that load it as a relationship """
+    for model, cache in CACHES.items():
+      if model is cls or any(rel.mapper.class_ is cls for rel in inspect(model).relationships):
+        cache.clear()
+
+  @classmethod
+  def _touch(cls, session: AsyncSession) -> None:
+    """ Drops cached results now and again once the session commits or rolls back """
+    session.info.setdefault(STALE_MODELS, set()).add(cls)
+    cls.invalidate_cache()
+
+  @classmethod
+  async def _commit(cls, session: AsyncSession) -> None:
+    cls._touch(session)
+    if session.info.get(UNIT_OF_WORK): await session.flush()
+    else: await session.commit()
+
+  @staticmethod
+  def on_commit(session: AsyncSession, callback) -> None:
+    """ Runs callback once the work done so far is committed: now outside unit-of-work mode, after the owner's commit inside it """
+    if session.info.get(UNIT_OF_WORK): session.info.setdefault(AFTER_COMMIT, []).append(callback)
+    else: callback()
+
+  @staticmethod
+  def cache_stats() -> dict[str, dict]:
+    return {model.__name__: cache.stats for model, cache in CACHES.items()}
+
+  @classmethod
+  async def _fetch(cls, session: AsyncSession, mode: str, load=None, columns: list[str] = None, **filters):
+    """ Runs a cached statement; mode is 'all', 'first' or 'scalars', served from the entity cache when enabled """
+    cache, key = cls._entity_cache(), None
+    if cache is not None:
+      key = (mode, tuple(load) if isinstance(load, list) else load, tuple(columns) if columns else None, tuple(sorted(filters.items())))
+      try:
+        cached = cache.get(key)
+      except TypeError:
+        cached, key = EntityCache._MISS, None
+      if cached is not EntityCache._MISS:
+        if columns: return list(cached) if mode != 'first' else cached
+        try:
+          if mode == 'first': return cached and await session.merge(_restore(cached), load=False)
+          return [await session.merge(_restore(snap), load=False) for snap in cached]
+        except InvalidRequestError:
+          pass
+    generation = cache.generation if key is not None else None
+    query, params = cls._statement(load, columns, **filters)
+    result = await session.execute(query, params)
+    if mode == 'first': value = result.first() if columns else result.scalars().first()
+    else: value = result.all() if columns and mode == 'all' else result.scalars().all()
+    if key is not None and cache.generation == generation:
+      if columns: cache.put(key, value if mode == 'first' else tuple(value))
+      else: cache.put(key, value and _snapshot(value) if mode == 'first' else tuple(_snapshot(obj) for obj in value))
+    return value
+
+  @classmethod
+  async def get(cls, session: AsyncSession, load=None, columns: list[str] = None, **filters):
+    return await cls._fetch(session, 'all', load, columns, **filters)
     
+  @classmethod
+  async def stream(cls, session: AsyncSession, chunk_size: int = 1000, load=None, columns: list[str] = None, as_json: bool = False, **filters) -> AsyncIterator:
+    """ Yields matching rows one by one over a server-side cursor fetched `chunk_size` rows at a time """
+    query, params = cls._statement(load, columns, **filters)
+    result = await session.stream(query.execution_options(yield_per=chunk_size), params)
+    if not columns: result = result.scalars()
+    async for partition in result.partitions():
+      for row in partition:
+        yield (row._asdict() if columns else row.json) if as_json else row
+
+  @classmethod
+  async def iter_pages(cls, session: AsyncSession, chunk_size: int = 1000, load=None, columns: list[str] = None, as_json: bool = False, **filters) -> AsyncIterator[list]:
+    """ Yields matching rows in pages of `chunk_size`, paginated by primary key; column rows always carry the key """
+    pk = inspect(cls).primary_key
+    if columns: columns = list(columns) + [c.key for c in pk if c.key not in columns]
+    base, params = cls._statement(load, columns, **filters)
+    base = base.order_by(*pk).limit(chunk_size)
+    last = None
+    while True:
+      query = base
+      if last is not None:
+        query = query.where(pk[0] > last[0] if len(pk) == 1 else tuple_(*pk) > tuple_(*last))
+      result = await session.execute(query, params)
+      page = result.all() if columns else result.scalars().all()
+      if not page: return
+      tail = page[-1]
+      last = tuple(getattr(tail, c.key) for c in pk)
+      yield [(row._asdict() if columns else row.json) for row in page] if as_json else page
+      if len(page) < chunk_size: return
+
   @classmethod
   async def get_multi(cls, session: AsyncSession, field: str, variables: list):
     if not getattr(cls, field, None):
@@ -58,71 +228,105 @@ class Base(DeclarativeBase):
     return result.scalars().all()
   
   @classmethod
-  async def create_uid(cls, session: AsyncSession):
-    existing = await session.execute(select(cls.uid))
-    uids = set(existing.scalars().all())
+  async def allocate_uids(cls, session: AsyncSession, count: int, column: str = 'uid', length: int = None) -> list[str]:
+    """ Draws `count` random values unused in `column`, checking each round of candidates with one indexed lookup """
+    col = cls.__table__.c[column]
+    length = length or col.type.length
     alp = string.ascii_letters + string.digits
-    while True:
-      uid = ''.join(secrets.choice(alp) for _ in range(cls.__table__.c.uid.type.length))
-      if uid not in uids:
-        return uid
-  
+    uids: set[str] = set()
+    while len(uids) < count:
+      candidates = {''.join(secrets.choice(alp) for _ in range(length)) for _ in range(count - len(uids))} - uids
+      taken = await session.execute(select(col).where(col.in_(candidates)))
+      uids |= candidates - set(taken.scalars().all())
+    return list(uids)
+
+  @classmethod
+  def _key_conflict(cls, error: IntegrityError, column: str) -> bool:
+    """ Whether an IntegrityError is a duplicate value in `column` rather than an FK or NOT NULL violation """
+    args = getattr(error.orig, 'args', None) or (None,)
+    code, message = args[0], str(args[-1])
+    if code == 1062: # MySQL ER_DUP_ENTRY, "... for key '<table>.<index>'"
+      key = message.rsplit('for key', 1)[-1].strip(" '\"").rsplit('.', 1)[-1]
+      if key == 'PRIMARY': return cls.__table__.c[column].primary_key
+      return key == column or any(idx.name == key and column in idx.columns.keys() for idx in cls.__table__.indexes)
+    return message.startswith('UNIQUE constraint failed') and f'{cls.__tablename__}.{column}' in message
+
+  @classmethod
+  async def create_uid(cls, session: AsyncSession):
+    return (await cls.allocate_uids(session, 1))[0]
+
   @classmethod
   async def create_uuid(cls, session: AsyncSession):
-    existing = await session.execute(select(cls.uuid))
-    uuids = set(existing.scalars().all())
-    alp = string.ascii_letters + string.digits
-    while True:
-      uuid = ''.join(secrets.choice(alp) for _ in range(32))
-      if uuid not in uuids:
-        return uuid
+    return (await cls.allocate_uids(session, 1, 'uuid', 32))[0]
+
+  @classmethod
+  async def insert_many(cls, session: AsyncSession, rows: list[dict], chunk_size: int = 1000, uid: str = None) -> int:
+    """ Inserts rows with one multi-row INSERT per chunk; with `uid`, fills that key column and redraws a chunk the key constraint rejects """
+    for i in range(0, len(rows), chunk_size):
+      chunk = rows[i:i + chunk_size]
+      if uid is None:
+        await session.execute(insert(cls).values(chunk))
+        continue
+      for attempt in range(cls.UID_ATTEMPTS):
+        for row, value in zip(chunk, await cls.allocate_uids(session, len(chunk), uid)):
+          row[uid] = value
+        try:
+          async with session.begin_nested():
+            await session.execute(insert(cls).values(chunk))
+          break
+        except IntegrityError as e:
+          if attempt == cls.UID_ATTEMPTS - 1 or not cls._key_conflict(e, uid): raise
+    cls._touch(session)
+    return len(rows)
       
   @classmethod
   async def list_column(cls, session: AsyncSession, column_name: str, **filters):
     if not hasattr(cls, column_name): raise AttributeError(f'{cls.__name__} has no column "{column_name}"')
-    query = select(getattr(cls, column_name))
-    simple, expressions = cls._build_filters(**filters)
-    query = query.filter_by(**simple) if simple else query.filter(*expressions)
-    result = await session.execute(query)
-    return result.scalars().all()
+    return await cls._fetch(session, 'scalars', columns=[column_name], **filters)
       
   @classmethod
-  async def first(cls, session: AsyncSession, **filters):
-    query = select(cls)
-    for rel in inspect(cls).relationships:
-      query = query.options(selectinload(getattr(cls, rel.key)))
-    simple, expressions = cls._build_filters(**filters)
-    query = query.filter_by(**simple) if simple else query.filter(*expressions)
-    result = await session.execute(query)
-    return result.scalars().first()
+  async def first(cls, session: AsyncSession, load=None, columns: list[str] = None, **filters):
+    return await cls._fetch(session, 'first', load, columns, **filters)
 
   @classmethod
-  async def get_json(cls, session: AsyncSession, **filters):
-    query = select(cls)
-    for rel in inspect(cls).relationships:
-      query = query.options(selectinload(getattr(cls, rel.key)))
-    simple, expressions = cls._build_filters(**filters)
-    query = query.filter_by(**simple) if simple else query.filter(*expressions)
-    result = await session.execute(query)
-    all_rows = result.scalars().all()
-    return [row.json for row in all_rows]
+  async def get_json(cls, session: AsyncSession, load=None, columns: list[str] = None, **filters):
+    rows = await cls._fetch(session, 'all', load, columns, **filters)
+    return [row._asdict() if columns else row.json for row in rows]
   
   @classmethod
-  async def bulk_update(cls, session: AsyncSession, data: dict[str, str], key: str, field: str, overwrite: bool = False):
-    if not data: return
-    column = getattr(cls, field)
-    for k, v in data.items():
-      conditions = [getattr(cls, key) == k]
+  async def bulk_update(cls, session: AsyncSession, data: dict, key: str, field: str = None, overwrite: bool = False, chunk_size: int = None) -> int:
+    """ Updates rows by `key` with one CASE statement per chunk, returns the affected row count
+
+    `data` maps key -> value of `field`, or key -> {field: value} when no field is given.
+    Without `overwrite` only NULL columns are filled in and only rows with a NULL target column
+    are counted, so a single-field call returns the number of rows actually filled.
+    """
+    rows = {k: {field: v} for k, v in data.items()} if field else {k: v for k, v in data.items() if v}
+    if not overwrite: # a None can't fill anything, but would still match the IS NULL guard and be counted
+      rows = {k: {n: v for n, v in r.items() if v is not None} for k, r in rows.items()}
+      rows = {k: r for k, r in rows.items() if r}
+    if not rows: return 0
+    key_col = getattr(cls, key)
+    keys, chunk_size = list(rows), chunk_size or cls.BULK_CHUNK_SIZE
+    affected = 0
+    for i in range(0, len(keys), chunk_size):
+      chunk = keys[i:i + chunk_size]
+      values, conditions = {}, [key_col.in_(chunk)]
+      for name in {name for k in chunk for name in rows[k]}:
+        column = getattr(cls, name)
+        new = case({k: rows[k][name] for k in chunk if name in rows[k]}, value=key_col, else_=column)
+        values[name] = new if overwrite else func.coalesce(column, new)
       if not overwrite:
-        conditions.append(column.is_(None))
-      query = update(cls).where(*conditions).values({field: v})
-      await session.execute(query)
-    await session.commit()
+        conditions.append(or_(*(getattr(cls, name).is_(None) for name in values)))
+      query = update(cls).where(*conditions).values(values).execution_options(synchronize_session=False)
+      affected += (await session.execute(query)).rowcount
+    await cls._commit(session)
+    return affected
     
   @classmethod
   async def truncate(cls, session: AsyncSession):
     await session.execute(text(f'TRUNCATE TABLE {cls.__tablename__}'))
-    await session.commit()
+    await cls._commit(session)
     
   @staticmethod
   def escape_m2(text):
@@ -140,12 +344,31 @@ class Base(DeclarativeBase):
           if isinstance(v, dt):
             v = int(v.timestamp())
         setattr(self, k, v)
-    await session.commit()
+    await self._commit(session)
 
   async def save(self, session: AsyncSession):
     session.add(self)
-    await session.commit()
+    await self._commit(session)
+
+  async def save_unique(self, session: AsyncSession, column: str = 'uid'):
+    """ Saves a row keyed by a random value, drawing a new one whenever the key constraint rejects it """
+    for attempt in range(self.UID_ATTEMPTS):
+      try:
+        async with session.begin_nested():
+          session.add(self)
+        break
+      except IntegrityError as e:
+        if attempt == self.UID_ATTEMPTS - 1 or not self._key_conflict(e, column): raise
+        setattr(self, column, (await self.allocate_uids(session, 1, column))[0])
+    await self._commit(session)
     
   async def delete(self, session: AsyncSession):
     await session.delete(self)
-    await session.commit()
+    await self._commit(session)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _invalidate_stale(session: Session, transaction):
+  if transaction.parent is not None: return
+  for model in session.info.pop(STALE_MODELS, ()):
+    model.invalidate_cache()
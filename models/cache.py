@@ -0,0 +1,49 @@
+from collections import OrderedDict
+import time
+
+CACHES: dict[type, "EntityCache"] = {}
+
+
+class EntityCache:
+  """ Bounded LRU of query results with a time-to-live """
+  _MISS = object()
+
+  def __init__(self, ttl: float = 60, maxsize: int = 256) -> None:
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self._items: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.generation = 0 # bumped by clear(), so results read before an invalidation are not stored after it
+
+  def get(self, key: tuple):
+    entry = self._items.get(key)
+    if entry is None or entry[0] < time.monotonic():
+      if entry is not None:
+        del self._items[key]
+        self.evictions += 1
+      self.misses += 1
+      return self._MISS
+    self.hits += 1
+    self._items.move_to_end(key)
+    return entry[1]
+
+  def put(self, key: tuple, value) -> None:
+    self._items[key] = (time.monotonic() + self.ttl, value)
+    self._items.move_to_end(key)
+    while len(self._items) > self.maxsize:
+      self._items.popitem(last=False)
+      self.evictions += 1
+
+  def clear(self) -> None:
+    self._items.clear()
+    self.generation += 1
+
+  @property
+  def stats(self) -> dict:
+    total = self.hits + self.misses
+    return dict(
+      size=len(self._items), maxsize=self.maxsize, ttl=self.ttl, hits=self.hits, misses=self.misses,
+      evictions=self.evictions, ratio=self.hits / total if total else 0.0
+    )
@@ -1,7 +1,11 @@
-from sqlalchemy import Enum, String, Boolean, JSON, Text, Integer
-from discord.ext.commands import CooldownMapping, BucketType
+from sqlalchemy import Enum, String, Boolean, JSON, Text, Integer, DateTime, select, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.mysql import DATETIME
 from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime as dt
 from .base import Base
+import hashlib
+import json
 import enum
 
 
@@ -15,6 +19,7 @@ class Method(enum.Enum):
 
 class Command(Base):
   __tablename__ = 'commands'
+  __cache__ = dict(ttl=300, maxsize=64)
   
   uid: Mapped[str] = mapped_column(String(8), primary_key=True)
   name: Mapped[str] = mapped_column(String(25), nullable=False, unique=True)
@@ -23,10 +28,19 @@ class Command(Base):
   superaccess: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
   fallback: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict(status='error', message='Server does not respond.'))
   cooldown: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+  cooldown_formula: Mapped[str] = mapped_column(String(255), nullable=True)
+  cache_ttl: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+  cache_scope: Mapped[str] = mapped_column(String(10), nullable=False, default='author', server_default='author')
+  max_concurrency: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+  queue_depth: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
   has_context: Mapped[bool] = mapped_column(Boolean, nullable=False, default=None)
   enabled: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
   help: Mapped[str] = mapped_column(Text, nullable=True)
   aliases: Mapped[str] = mapped_column(String(255), nullable=True)
+  updated: Mapped[dt] = mapped_column( # microseconds, so edits within one second still move max(updated)
+    DateTime().with_variant(DATETIME(fsp=6), 'mysql'), nullable=False, default=func.now(6), onupdate=func.now(6),
+    server_default=text('CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)')
+  )
   
   def __init__(self, uid, name, endpoint, method, superaccess: bool = False, fallback: dict = None, cooldown: int = None, **kwargs) -> None:
     self.uid = uid
@@ -36,6 +50,11 @@ class Command(Base):
     self.superaccess = superaccess
     self.fallback = fallback
     self.cooldown = cooldown
+    self.cooldown_formula = kwargs.get('cooldown_formula')
+    self.cache_ttl = kwargs.get('cache_ttl') or 0
+    self.cache_scope = kwargs.get('cache_scope') or 'author'
+    self.max_concurrency = kwargs.get('max_concurrency') or 0
+    self.queue_depth = kwargs.get('queue_depth') or 0
     self.has_context = kwargs.get('has_context')
     self.enabled = kwargs.get('enabled')
     self.help = kwargs.get('help')
@@ -48,14 +67,38 @@ class Command(Base):
   @property
   def params(self):
     return dict(method=self.method.value, endpoint=self.endpoint)
+
+  @classmethod
+  async def catalog_state(cls, session: AsyncSession) -> tuple:
+    """ Cheap (last update, row count) marker for change polling """
+    result = await session.execute(select(func.max(cls.updated), func.count()).select_from(cls))
+    return tuple(result.one())
+
+  @property
+  def fingerprint(self):
+    return hashlib.sha1(json.dumps(self.json, sort_keys=True, default=str).encode()).hexdigest()
+
+  @property
+  def fallback_reply(self):
+    fallback = self.fallback or {}
+    return fallback.get('reply') or fallback.get('message') or 'Server does not respond.'
+
+  @property
+  def cache_opts(self):
+    return dict(cache_ttl=self.cache_ttl, cache_scope=self.cache_scope)
   
+  @property
+  def concurrency_opts(self):
+    return dict(max_concurrency=self.max_concurrency, queue_depth=self.queue_depth)
+
   @property
   def cmd_opts(self):
-    return dict(name=self.name, enabled=self.enabled, help=self.help, aliases=self.alias, cooldown=CooldownMapping.from_cooldown(1, self.cooldown, BucketType.user))
+    return dict(name=self.name, enabled=self.enabled, help=self.help, aliases=self.alias)
     
   @property
   def json(self):
     return dict(
       uid=self.uid, name=self.name, endpoint=self.endpoint, method=self.method.value, superaccess=self.superaccess, fallback=self.fallback, cooldown=self.cooldown,
-      has_context=self.has_context, enabled=self.enabled, help=self.help, aliases=self.alias
+      cooldown_formula=self.cooldown_formula, cache_ttl=self.cache_ttl, cache_scope=self.cache_scope,
+      max_concurrency=self.max_concurrency, queue_depth=self.queue_depth, has_context=self.has_context, enabled=self.enabled, help=self.help, aliases=self.alias
     ) 
@@ -0,0 +1,24 @@
+from sqlalchemy import BigInteger, Integer, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from .base import Base
+
+
+class MessageDelta(Base):
+  __tablename__ = 'message_deltas'
+  __table_args__ = (
+    Index('ix_message_deltas_created', 'created'),
+    Base.__table_args__,
+  )
+  
+  message_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+  author: Mapped[int] = mapped_column(BigInteger, nullable=False)
+  delta: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+  
+  def __init__(self, message_id, author, delta, **kwargs) -> None:
+    self.message_id = message_id
+    self.author = author
+    self.delta = delta
+    
+  @property
+  def json(self):
+    return dict(message_id=self.message_id, author=self.author, delta=self.delta, created=self.created_ts)
@@ -5,6 +5,7 @@ from .base import Base
 
 class Role(Base):
   __tablename__ = 'roles'
+  __cache__ = dict(ttl=600, maxsize=64)
   
   uid: Mapped[str] = mapped_column(String(10), primary_key=True)
   name: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
@@ -12,7 +13,7 @@ class Role(Base):
   permissions: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
   reason: Mapped[int] = mapped_column(String(150), nullable=True)
   
-  guilds: Mapped["ServerRole"] = relationship("ServerRole", back_populates="roles", uselist=True, cascade="all, delete-orphan", lazy='selectin')
+  guilds: Mapped["ServerRole"] = relationship("ServerRole", back_populates="roles", uselist=True, cascade="all, delete-orphan")
 
   def __init__(self, uid, name, color, permissions, reason=None, **kwargs) -> None:
     self.uid = uid
@@ -39,11 +40,12 @@ class Role(Base):
 
 class ServerRole(Base):
   __tablename__ = 'server_roles'
+  __cache__ = dict(ttl=600, maxsize=256)
   
   id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
   role_uid: Mapped[int] = mapped_column(String(10), ForeignKey('roles.uid'), nullable=False)
   role_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
-  guild_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+  guild_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
   
   roles: Mapped["Role"] = relationship("Role", back_populates="guilds")
 
@@ -0,0 +1,18 @@
+from sqlalchemy import String, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+from .base import Base
+
+
+class SchemaVersion(Base):
+  __tablename__ = 'schema_version'
+  
+  version: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+  description: Mapped[str] = mapped_column(String(255), nullable=False)
+  
+  def __init__(self, version, description, **kwargs) -> None:
+    self.version = version
+    self.description = description
+    
+  @property
+  def json(self):
+    return dict(version=self.version, description=self.description, created=self.created_ts)
@@ -1,5 +1,9 @@
 from sqlalchemy import String, Integer, BigInteger, Boolean, ForeignKey, DateTime
+from sqlalchemy import select, update, insert, case
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.ext.asyncio import AsyncSession
+from .xp_history import XPHistory, Source
+from collections import defaultdict
 from datetime import datetime as dt
 from discord import Color, Asset
 from .base import Base
@@ -11,7 +15,7 @@ class GuildUser(Base):
   __tablename__ = 'users'
   
   uid: Mapped[str] = mapped_column(String(6), primary_key=True)
-  id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+  id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
   accent_color: Mapped[int] = mapped_column(Integer, nullable=True) # Color.value
   avatar: Mapped[str] = mapped_column(String(255), nullable=True) # Asset.url
   avatar_decoration: Mapped[str] = mapped_column(String(255), nullable=True) # Asset.url
@@ -25,7 +29,7 @@ class GuildUser(Base):
   premium_since: Mapped[dt] = mapped_column(DateTime, nullable=True)
   xp_total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
   
-  xp_history: Mapped[list["XPHistory"]] = relationship("XPHistory", back_populates="user", lazy='selectin', cascade="all, delete-orphan", uselist=True) # type: ignore
+  xp_history: Mapped[list["XPHistory"]] = relationship("XPHistory", back_populates="user", cascade="all, delete-orphan", uselist=True) # type: ignore
   
   def __init__(self, uid, created_at, id, joined_at, name, **kwargs) -> None:
     self.uid = uid
@@ -55,14 +59,65 @@ class GuildUser(Base):
       return value.url
     return value
   
+  PROFILE_FIELDS = (
+    'name', 'global_name', 'accent_color', 'avatar', 'avatar_decoration', 'avatar_decoration_sku_id', 'banner', 'color', 'premium_since'
+  )
+
+  @classmethod
+  def profile_values(cls, m) -> dict:
+    """ Profile columns present on a discord Member or User """
+    values = {}
+    for field in cls.PROFILE_FIELDS:
+      if not hasattr(m, field): continue
+      value = getattr(m, field)
+      values[field] = cls._validate_asset(cls._validate_color(value))
+    return values
+
+  @classmethod
+  def member_values(cls, uid: str, m) -> dict:
+    """ Insert row for a discord Member """
+    return dict(uid=uid, id=m.id, created_at=m.created_at, joined_at=m.joined_at, **cls.profile_values(m))
+
   @staticmethod
   def to_hex(value: int = None):
     if not value: return None
     return f"#{16777215:06X}"
   
   async def buff(self, session, delta: int) -> None:
-    self.xp_total += delta
-    await session.commit()
+    query = (
+      update(GuildUser).where(GuildUser.uid == self.uid).values(xp_total=GuildUser.xp_total + delta)
+      .execution_options(synchronize_session=False)
+    )
+    await session.execute(query)
+    self.xp_total = (await session.execute(select(GuildUser.xp_total).where(GuildUser.uid == self.uid))).scalar_one()
+    await self._commit(session)
+
+  @classmethod
+  async def grant_xp(cls, session: AsyncSession, grants: list[tuple[int, str, int, str]], known: dict[int, str] = None) -> dict[int, int]:
+    """ Applies (discord_id, source, delta, multiplier) grants in one transaction, returns new totals by discord id """
+    if not grants: return {}
+    uids = dict(known or {})
+    missing = {g[0] for g in grants} - set(uids)
+    if missing:
+      result = await session.execute(select(cls.id, cls.uid).where(cls.id.in_(missing)))
+      uids.update(result.all())
+    totals, history = defaultdict(int), []
+    for discord_id, source, delta, multiplier in grants:
+      uid = uids.get(discord_id)
+      if uid is None or not delta: continue
+      totals[uid] += delta
+      history.append(dict(uuid=uid, source=Source(source), delta=delta, multiplier=multiplier))
+    if not history: return {}
+    await session.execute(
+      update(cls).where(cls.uid.in_(list(totals)))
+      .values(xp_total=cls.xp_total + case(totals, value=cls.uid, else_=0))
+      .execution_options(synchronize_session=False)
+    )
+    await session.execute(insert(XPHistory).values(history))
+    result = await session.execute(select(cls.id, cls.xp_total).where(cls.uid.in_(list(totals))))
+    new_totals = dict(result.all())
+    await cls._commit(session)
+    return new_totals
 
   @property
   def json(self):
@@ -77,9 +132,10 @@ class GuildUser(Base):
 
 class UserWatchDog(Base):
   __tablename__ = 'users_watchdog'
+  __cache__ = dict(ttl=300, maxsize=256)
   
   uid: Mapped[str] = mapped_column(String(3), primary_key=True)
-  uuid: Mapped[GuildUser] = mapped_column(String(6), ForeignKey('users.uid'), nullable=False)
+  uuid: Mapped[GuildUser] = mapped_column(String(6), ForeignKey('users.uid'), nullable=False, index=True)
   active: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
   
   def __init__(self, uid, uuid, **kwargs) -> None:
@@ -88,7 +144,7 @@ class UserWatchDog(Base):
     
   async def deactivate(self, session):
     self.active = True
-    await session.commit()
+    await self._commit(session)
 
   @property
   def json(self):
@@ -1,4 +1,4 @@
-from sqlalchemy import Enum, String, Boolean, Integer, ForeignKey
+from sqlalchemy import Enum, String, Boolean, Integer, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.dialects.mysql import SMALLINT
 from .base import Base
@@ -15,6 +15,10 @@ class Source(enum.Enum):
   
 class XPHistory(Base):
   __tablename__ = 'experience_history'
+  __table_args__ = (
+    Index('ix_experience_history_uuid_created', 'uuid', 'created'),
+    Base.__table_args__,
+  )
   
   id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
   uuid: Mapped[str] = mapped_column(String(6), ForeignKey('users.uid'), nullable=False) 
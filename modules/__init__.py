@@ -1,6 +1,13 @@
-from .client import Client
+from .client import Client, BadResponse, CircuitOpen
 from .models import Response, Reply
 from .recording import Record
-from .api_checker import check
-from .cooldown import SafeEval
+from .presence import VoicePresence
+from .api_checker import HealthMonitor
+from .limiter import ConcurrencyLimit, QueueFull
+from .cooldown import SafeEval, BoundedCooldownMapping
 from .message_entities import MessageAnalyzer
+from .identity import IdentityMap, Identity
+from .xp_ledger import XPLedger
+from .message_store import MessageDeltaStore
+from .startup import Startup, RateBudget
+from .profile_sync import ProfileSync
@@ -1,13 +1,73 @@
-from urllib.request import urlopen
-import socket
-import os
-
-def check() -> bool:
-  url = f'http://{os.getenv("API_HOST", "127.0.0.1")}:{os.getenv("API_PORT", "80")}/api/status'
-  timeout = 10
-  socket.setdefaulttimeout(timeout)
-  try:
-    with urlopen(url) as r:
-      return r.status == 200
-  except:
-    return False
+from typing import Awaitable, Callable
+from aiohttp import ClientError
+from bot.utils import setup_logger
+from .client import Client
+import asyncio
+import time
+
+logger = setup_logger('APIHealth', filename='bot_api_health.log')
+
+
+class HealthMonitor:
+  """ Periodically probes the backend status endpoint and notifies listeners once `threshold` probes in a row disagree with the current state """
+  def __init__(self, client: Client, path: str = '/api/status', interval: float = 30, timeout: float = 3, threshold: int = 3, **kwargs) -> None:
+    self.client = client
+    self.path = path
+    self.interval = interval
+    self.timeout = timeout
+    self.threshold = threshold
+    self.available = False
+    self.latency: float = None
+    self.checks = 0
+    self.failures = 0
+    self._streak = 0 # consecutive probes contradicting `available`
+    self._listeners: list[Callable[[bool], Awaitable]] = []
+    self._task: asyncio.Task = None
+
+  def on_change(self, callback: Callable[[bool], Awaitable]) -> None:
+    self._listeners.append(callback)
+
+  async def probe(self) -> bool:
+    started = time.perf_counter()
+    try:
+      ok = await self.client.probe(self.path, self.timeout) == 200
+    except (ClientError, asyncio.TimeoutError):
+      ok = False
+    self.latency = time.perf_counter() - started
+    self.checks += 1
+    self.failures += not ok
+    self._streak = self._streak + 1 if ok != self.available else 0
+    if self._streak >= self.threshold or (ok and self.checks == 1):
+      self.available, self._streak = ok, 0
+      logger.info(f'API became {"available" if ok else "unavailable"} (latency {self.latency:.3f}s)')
+      for callback in self._listeners:
+        try:
+          await callback(ok)
+        except Exception:
+          logger.exception('Health listener failed')
+    return ok
+
+  def start(self) -> None:
+    if self._task is None:
+      self._task = asyncio.create_task(self._worker())
+
+  async def stop(self) -> None:
+    if self._task is None: return
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+    self._task = None
+
+  async def _worker(self) -> None:
+    while True:
+      try:
+        await self.probe()
+      except Exception:
+        logger.exception('Health probe failed')
+      await asyncio.sleep(self.interval)
+
+  @property
+  def json(self):
+    return dict(available=self.available, latency=self.latency, checks=self.checks, failures=self.failures)
@@ -1,5 +1,8 @@
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from collections import OrderedDict, deque
 from .models import Response
+import asyncio
+import time
 import os
 
 class BadResponse(Exception):
@@ -13,12 +16,103 @@ class BadResponse(Exception):
     return f'{self.message} (status={self.status})'
 
 
+class CircuitOpen(Exception):
+  def __init__(self, endpoint: str, retry_after: float) -> None:
+    self.endpoint = endpoint
+    self.retry_after = retry_after
+    super().__init__(f'Circuit for {endpoint} is open, retry in {retry_after:.1f}s')
+
+
+class CircuitBreaker:
+  """ Opens after too many failures in a sliding window, then lets probes through after reset_timeout """
+  CLOSED = 'closed'
+  OPEN = 'open'
+  HALF_OPEN = 'half_open'
+
+  def __init__(self, endpoint: str, window: int = 20, failure_rate: float = 0.5, min_calls: int = 5, reset_timeout: float = 30, half_open_probes: int = 1, **kwargs) -> None:
+    self.endpoint = endpoint
+    self.failure_rate = failure_rate
+    self.min_calls = min_calls
+    self.reset_timeout = reset_timeout
+    self.half_open_probes = half_open_probes
+    self.results: deque[bool] = deque(maxlen=window)
+    self.state = self.CLOSED
+    self.opened_at = 0.0
+    self.probes = 0
+
+  def acquire(self) -> None:
+    if self.state == self.OPEN:
+      retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+      if retry_after > 0: raise CircuitOpen(self.endpoint, retry_after)
+      self.state, self.probes = self.HALF_OPEN, 0
+    if self.state == self.HALF_OPEN:
+      if self.probes >= self.half_open_probes: raise CircuitOpen(self.endpoint, self.reset_timeout)
+      self.probes += 1
+
+  def record(self, ok: bool) -> None:
+    if self.state == self.HALF_OPEN:
+      if ok:
+        self.state = self.CLOSED
+        self.results.clear()
+      else:
+        self._open()
+      return
+    self.results.append(ok)
+    if len(self.results) >= self.min_calls and self.results.count(False) / len(self.results) >= self.failure_rate:
+      self._open()
+
+  def _open(self) -> None:
+    self.state = self.OPEN
+    self.opened_at = time.monotonic()
+    self.results.clear()
+
+  @property
+  def json(self):
+    return dict(endpoint=self.endpoint, state=self.state, calls=len(self.results), failures=self.results.count(False))
+
+
+class RequestStats:
+  __slots__ = ('requests', 'errors', 'latency_total', 'latency_max', 'cache_hits', 'coalesced')
+
+  def __init__(self) -> None:
+    self.requests = 0
+    self.errors = 0
+    self.latency_total = 0.0
+    self.latency_max = 0.0
+    self.cache_hits = 0
+    self.coalesced = 0
+
+  def record(self, latency: float, ok: bool = True) -> None:
+    self.requests += 1
+    self.errors += not ok
+    self.latency_total += latency
+    self.latency_max = max(self.latency_max, latency)
+
+  @property
+  def json(self):
+    return dict(
+      requests=self.requests, errors=self.errors, latency_max=round(self.latency_max, 4),
+      latency_avg=round(self.latency_total / self.requests, 4) if self.requests else 0.0,
+      cache_hits=self.cache_hits, coalesced=self.coalesced,
+    )
+
+
 class Client:
-  def __init__(self):
+  def __init__(self, limit: int = 100, limit_per_host: int = 0, keepalive_timeout: float = 30, ttl_dns_cache: int = 300, timeout: float = 30, cache_size: int = 1000, breaker: dict = None, **kwargs):
     self.session = ClientSession(
       base_url=f'http://{os.getenv("API_HOST", "127.0.0.1")}:{int(os.getenv("API_PORT", "8080"))}',
       headers={'X-Department': 'DataChort Discord Bot'},
+      timeout=ClientTimeout(total=timeout),
+      connector=TCPConnector(
+        limit=limit, limit_per_host=limit_per_host, keepalive_timeout=keepalive_timeout, ttl_dns_cache=ttl_dns_cache
+      ),
     )
+    self.stats = RequestStats()
+    self.cache_size = cache_size
+    self._responses: OrderedDict[tuple, tuple[float, Response]] = OrderedDict()
+    self._inflight: dict[tuple, asyncio.Task] = {}
+    self.breaker_opts = breaker or {}
+    self.breakers: dict[str, CircuitBreaker] = {}
     
   @staticmethod
   def _build_req(method: str, *, params=None, json=None, **kwargs):
@@ -45,21 +139,81 @@ class Client:
       params.update(normalized_kwargs)
       return params, None
 
-  async def _request(self, method, url, *args, params=None, json=None, headers=None, **kwargs) -> Response:
+  async def _request(self, method, url, *args, params=None, json=None, headers=None, timeout: float = None, **kwargs) -> Response:
     params, json = self._build_req(method, params=params, json=json, **kwargs)
-    if headers: self.session.headers.update(headers)
-    async with self.session.request(method, url, params=params, json=json) as resp:
-      if resp.status == 200:
-        response = await resp.json()
-        return Response(**response)
-      try:
-        body = await resp.json()
-      except Exception:
-        body = await resp.text()
-      raise BadResponse(status=resp.status, message=body.get('message') or body, body=body)
+    options = dict(params=params, json=json, headers=headers)
+    if timeout: options['timeout'] = ClientTimeout(total=timeout)
+    breaker = self._breaker(url)
+    breaker.acquire()
+    started, status = time.perf_counter(), None
+    try:
+      async with self.session.request(method, url, **options) as resp:
+        status = resp.status
+        if resp.status == 200:
+          response = await resp.json()
+          return Response(**response)
+        try:
+          body = await resp.json()
+        except Exception:
+          body = await resp.text()
+        raise BadResponse(status=resp.status, message=body.get('message') if isinstance(body, dict) else body, body=body)
+    finally:
+      self.stats.record(time.perf_counter() - started, status == 200)
+      breaker.record(status is not None and status < 500)
+
+  def _breaker(self, url: str) -> CircuitBreaker:
+    breaker = self.breakers.get(url)
+    if breaker is None:
+      breaker = self.breakers[url] = CircuitBreaker(url, **self.breaker_opts)
+    return breaker
   
-  async def ask(self, method, endpoint, **kwargs) -> Response:
-    return await self._request(method, f'/{endpoint}', **kwargs)
+  async def probe(self, path: str, timeout: float) -> int:
+    async with self.session.get(path, timeout=ClientTimeout(total=timeout)) as resp:
+      return resp.status
+
+  @staticmethod
+  def _cache_key(method: str, endpoint: str, scope: str, kwargs: dict) -> tuple:
+    params = {k: v for k, v in kwargs.items() if not (scope == 'global' and k == 'author')}
+    return (method, endpoint, tuple(sorted((k, repr(v)) for k, v in params.items())))
+
+  def _cached(self, key: tuple) -> Response | None:
+    entry = self._responses.get(key)
+    if entry is None: return None
+    expires, response = entry
+    if expires < time.monotonic():
+      del self._responses[key]
+      return None
+    self._responses.move_to_end(key)
+    return response
+
+  def _store(self, key: tuple, ttl: float, response: Response) -> None:
+    self._responses[key] = (time.monotonic() + ttl, response)
+    self._responses.move_to_end(key)
+    while len(self._responses) > self.cache_size:
+      self._responses.popitem(last=False)
+
+  async def ask(self, method, endpoint, cache_ttl: float = 0, cache_scope: str = 'author', **kwargs) -> Response:
+    if method.upper() != 'GET':
+      return await self._request(method, f'/{endpoint}', **kwargs)
+    key = self._cache_key(method.upper(), endpoint, cache_scope, kwargs)
+    if cache_ttl and (response := self._cached(key)) is not None:
+      self.stats.cache_hits += 1
+      return response
+    task = self._inflight.get(key)
+    if task is None:
+      task = asyncio.ensure_future(self._request(method, f'/{endpoint}', **kwargs))
+      self._inflight[key] = task
+      task.add_done_callback(lambda _: self._inflight.pop(key, None))
+    else:
+      self.stats.coalesced += 1
+    response = await asyncio.shield(task)
+    if cache_ttl: self._store(key, cache_ttl, response)
+    return response
+
+  def invalidate(self, endpoint: str = None) -> None:
+    if endpoint is None: return self._responses.clear()
+    for key in [k for k in self._responses if k[1] == endpoint]:
+      del self._responses[key]
 
   async def close(self):
     await self.session.close()
@@ -1,14 +1,56 @@
+from discord.ext.commands import Context, Cooldown, DynamicCooldownMapping, BucketType
+from functools import lru_cache, reduce
+from typing import Callable
+from bot.utils import setup_logger
+import time
 import ast
-import operator
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+logger = setup_logger('Cooldowns', filename='bot_cooldowns.log')
+
+
+class Formula:
+  """ Validated, compiled SafeEval expression """
+  __slots__ = ('expr', 'code', 'names')
+
+  def __init__(self, expr: str, code, names: frozenset[str]) -> None:
+    self.expr = expr
+    self.code = code
+    self.names = names
+
+  def __call__(self, variables: dict = None, **kwargs) -> float:
+    scope = dict(variables or {}, **kwargs)
+    missing = self.names - scope.keys()
+    if missing: raise KeyError(', '.join(sorted(missing)))
+    return eval(self.code, {'__builtins__': {}, **SafeEval.SAFE_FUNCTIONS}, scope)
+
+  def many(self, columns: dict[str, list]) -> list:
+    missing = self.names - columns.keys()
+    if missing: raise KeyError(', '.join(sorted(missing)))
+    size = len(next(iter(columns.values()))) if columns else 0
+    if np is None:
+      keys = list(columns)
+      return [self(dict(zip(keys, row))) for row in zip(*(columns[k] for k in keys))]
+    scope = {k: np.asarray(v, dtype=float) for k, v in columns.items()}
+    result = eval(self.code, {'__builtins__': {}, **SafeEval.VECTOR_FUNCTIONS}, scope)
+    return np.broadcast_to(result, (size,)).tolist()
+
+  def __repr__(self) -> str:
+    return f'<Formula {self.expr}>'
+
 
 class SafeEval:
   ALLOWED_NODES = {
-    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Num,
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load,
     ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod,
     ast.Pow, ast.USub, ast.UAdd, ast.Constant,
     ast.Call, ast.Name
   }
-  
+
   SAFE_FUNCTIONS = {
     "max": max,
     "min": min,
@@ -16,57 +58,87 @@ class SafeEval:
     "round": round
   }
 
+  VECTOR_FUNCTIONS = {
+    "max": lambda *args: reduce(np.maximum, args),
+    "min": lambda *args: reduce(np.minimum, args),
+    "abs": lambda x: np.abs(x),
+    "round": lambda x, n=0: np.round(x, n),
+  } if np is not None else {}
+
   @staticmethod
-  def eval(expr: str, variables: dict) -> float:
+  @lru_cache(maxsize=256)
+  def compile(expr: str) -> Formula:
     tree = ast.parse(expr, mode="eval")
-
+    calls = set()
     for node in ast.walk(tree):
       if type(node) not in SafeEval.ALLOWED_NODES:
         raise ValueError("Unsafe expression")
+      if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in SafeEval.SAFE_FUNCTIONS or node.keywords:
+          raise ValueError("Unsafe function")
+        calls.add(id(node.func))
+      if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+        raise ValueError("Unsupported syntax")
+    names = frozenset(
+      node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and id(node) not in calls
+    )
+    return Formula(expr, compile(tree, '<safeeval>', 'eval'), names)
 
-    return SafeEval._eval_node(tree.body, variables)
+  @staticmethod
+  def eval(expr: str, variables: dict) -> float:
+    return SafeEval.compile(expr)(variables)
 
   @staticmethod
-  def _eval_node(node, variables):
-    if isinstance(node, ast.Num):
-      return node.n
-
-    if isinstance(node, ast.Constant):
-      return node.value
-
-    if isinstance(node, ast.Name):
-      return variables[node.id]
-
-    if isinstance(node, ast.BinOp):
-      left = SafeEval._eval_node(node.left, variables)
-      right = SafeEval._eval_node(node.right, variables)
-
-      op = node.op
-      if isinstance(op, ast.Add):
-        return left + right
-      if isinstance(op, ast.Sub):
-        return left - right
-      if isinstance(op, ast.Mult):
-        return left * right
-      if isinstance(op, ast.Div):
-        return left / right
-      if isinstance(op, ast.Mod):
-        return left % right
-      if isinstance(op, ast.Pow):
-        return left ** right
-
-    if isinstance(node, ast.UnaryOp):
-      operand = SafeEval._eval_node(node.operand, variables)
-      if isinstance(node.op, ast.UAdd):
-        return +operand
-      if isinstance(node.op, ast.USub):
-        return -operand
-
-    if isinstance(node, ast.Call):
-      func_name = node.func.id
-      if func_name not in SafeEval.SAFE_FUNCTIONS:
-        raise ValueError("Unsafe function")
-      args = [SafeEval._eval_node(a, variables) for a in node.args]
-      return SafeEval.SAFE_FUNCTIONS[func_name](*args)
-
-    raise ValueError("Unsupported syntax")
+  def eval_many(expr: str, columns: dict[str, list]) -> list:
+    """ Evaluates one formula over equally sized columns of variables, vectorized with numpy when available """
+    return SafeEval.compile(expr).many(columns)
+
+
+class BoundedCooldownMapping(DynamicCooldownMapping):
+  """ Per-user cooldown buckets with a size bound and throttled expiry sweeps """
+  def __init__(self, factory: Callable[[Context], Cooldown], type=BucketType.user, maxsize: int = 10000, sweep_interval: int = 60) -> None:
+    super().__init__(factory, type)
+    self.maxsize = maxsize
+    self.sweep_interval = sweep_interval
+    self._swept = 0.0
+
+  @classmethod
+  def from_formula(cls, per: float, formula: str = None, variables: Callable[[Context], dict] = None, rate: int = 1, **kwargs):
+    compiled = None
+    if formula:
+      try:
+        compiled = SafeEval.compile(formula)
+      except (ValueError, SyntaxError):
+        logger.exception(f'Invalid cooldown formula {formula!r}, using fixed cooldown of {per}s')
+
+    def factory(ctx: Context) -> Cooldown:
+      if compiled is None: return Cooldown(rate, per)
+      try:
+        return Cooldown(rate, max(0.0, float(compiled(variables(ctx), cooldown=per))))
+      except Exception:
+        logger.exception(f'Failed to evaluate cooldown formula {formula!r}')
+        return Cooldown(rate, per)
+    return cls(factory, **kwargs)
+
+  def copy(self) -> 'BoundedCooldownMapping':
+    ret = BoundedCooldownMapping(self._factory, self._type, self.maxsize, self.sweep_interval)
+    ret._cache = self._cache.copy()
+    return ret
+
+  def _verify_cache_integrity(self, current: float = None) -> None:
+    current = current or time.time()
+    if current - self._swept < self.sweep_interval: return
+    self._swept = current
+    super()._verify_cache_integrity(current)
+
+  def get_bucket(self, message: Context, current: float = None) -> Cooldown:
+    bucket = super().get_bucket(message, current)
+    while len(self._cache) > self.maxsize:
+      self._cache.pop(next(iter(self._cache)))
+    return bucket
+
+  def evict(self) -> int:
+    size = len(self._cache)
+    self._swept = 0.0
+    self._verify_cache_integrity()
+    return size - len(self._cache)
@@ -0,0 +1,78 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from collections import OrderedDict
+from bot.models import GuildUser
+
+
+class Identity:
+  __slots__ = ('uid', 'name', 'xp_total')
+
+  def __init__(self, uid: str, name: str, xp_total: int = 0) -> None:
+    self.uid = uid
+    self.name = name
+    self.xp_total = xp_total
+
+  def __repr__(self) -> str:
+    return f'<Identity uid={self.uid} name={self.name}>'
+
+
+class IdentityMap:
+  """ Bounded LRU of discord id -> GuildUser identity """
+  def __init__(self, maxsize: int = 50000) -> None:
+    self.maxsize = maxsize
+    self._items: OrderedDict[int, Identity] = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self._items)
+
+  def __contains__(self, discord_id):
+    return discord_id in self._items
+
+  def get(self, discord_id: int) -> Identity | None:
+    identity = self._items.get(discord_id)
+    if identity is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self._items.move_to_end(discord_id)
+    return identity
+
+  def put(self, discord_id: int, uid: str, name: str, xp_total: int = 0) -> Identity:
+    identity = Identity(uid, name, xp_total)
+    self._items[discord_id] = identity
+    self._items.move_to_end(discord_id)
+    while len(self._items) > self.maxsize:
+      self._items.popitem(last=False)
+    return identity
+
+  def rename(self, discord_id: int, name: str) -> None:
+    identity = self._items.get(discord_id)
+    if identity: identity.name = name
+
+  def update_xp(self, totals: dict[int, int]) -> None:
+    for discord_id, xp_total in totals.items():
+      identity = self._items.get(discord_id)
+      if identity: identity.xp_total = xp_total
+
+  def discard(self, discord_id: int) -> None:
+    self._items.pop(discord_id, None)
+
+  def uids(self, discord_ids) -> dict[int, str]:
+    known = {}
+    for discord_id in discord_ids:
+      identity = self.get(discord_id)
+      if identity: known[discord_id] = identity.uid
+    return known
+
+  async def resolve(self, session: AsyncSession, discord_id: int) -> Identity | None:
+    identity = self.get(discord_id)
+    if identity: return identity
+    row = await GuildUser.first(session, columns=['uid', 'name', 'global_name', 'xp_total'], id=discord_id)
+    if not row: return None
+    return self.put(discord_id, row.uid, row.global_name or row.name, row.xp_total)
+
+  @property
+  def stats(self) -> dict:
+    total = self.hits + self.misses
+    return dict(size=len(self._items), maxsize=self.maxsize, hits=self.hits, misses=self.misses, ratio=self.hits / total if total else 0.0)
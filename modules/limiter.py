@@ -0,0 +1,58 @@
+import asyncio
+
+
+class QueueFull(Exception):
+  pass
+
+
+class ConcurrencyLimit:
+  """ Semaphore that lets at most `queue_depth` callers wait for a slot, optionally nested in a parent limit; 0 means unlimited for both """
+  def __init__(self, max_concurrency: int = 0, queue_depth: int = 0, parent: 'ConcurrencyLimit' = None) -> None:
+    self.max_concurrency = max_concurrency
+    self.queue_depth = queue_depth
+    self.parent = parent
+    self._sem = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+    self.waiting = 0
+    self.rejected = 0
+
+  @property
+  def active(self) -> int:
+    return self.max_concurrency - self._sem._value if self._sem else 0
+
+  async def acquire(self) -> None:
+    if self._sem is not None:
+      if self._sem.locked():
+        if self.queue_depth and self.waiting >= self.queue_depth:
+          self.rejected += 1
+          raise QueueFull()
+        self.waiting += 1
+        try:
+          await self._sem.acquire()
+        finally:
+          self.waiting -= 1
+      else:
+        await self._sem.acquire()
+    if self.parent is None: return
+    try:
+      await self.parent.acquire()
+    except BaseException:
+      self._release()
+      raise
+
+  def _release(self) -> None:
+    if self._sem is not None: self._sem.release()
+
+  def release(self) -> None:
+    if self.parent is not None: self.parent.release()
+    self._release()
+
+  async def __aenter__(self):
+    await self.acquire()
+    return self
+
+  async def __aexit__(self, *exc):
+    self.release()
+
+  @property
+  def json(self):
+    return dict(max_concurrency=self.max_concurrency, queue_depth=self.queue_depth, active=self.active, waiting=self.waiting, rejected=self.rejected)
@@ -1,247 +1,150 @@
-from typing import Dict, List, Optional
 from discord import Message, Thread
-from heapq import heappush, heappop
-from urllib.parse import urlparse
+from functools import lru_cache
 import re
 
-class MessageTypes:
-  def __init__(self):
-    self._heap = []
-    self._set = set()
-    
-  def __iter__(self):
-    return iter(self._heap)
-  
-  def __len__(self):
-    return len(self._set)
-  
-  def __contains__(self, item):
-    return item in self._set
-    
-  def add(self, item):
-    if item not in self._set:
-      self._set.add(item)
-      heappush(self._heap, item)
-  
-  def pop(self):
-    item = heappop(self._heap)
-    self._set.remove(item)
-    return item
-  
-  def clear(self):
-    self._set.clear()
-    self._heap.clear()
-  
-  @property
-  def json(self):
-    return [i for i in self._set]
-  
-  def __str__(self):
-    return f','.join(self._set)
-
-
-class MessageEntityItem(set):
-  def add(self, item):
-    if isinstance(item, list):
-      for i in item:
-        super().add(i)
-    else: super().add(item)
-    
-  def __repr__(self):
-    return ', '.join([i for i in self]) if len(self) >= 1 else "''"
-
-class MessageEntities:
-  urls = MessageEntityItem()
-  images = MessageEntityItem()
-  videos = MessageEntityItem()
-  audios = MessageEntityItem()
-  gifs = MessageEntityItem()
-  role_mentions = MessageEntityItem()
-  user_mentions = MessageEntityItem()
-  mention_everyone: bool = False
-  reply_to_message: int = None
-  thread_start: bool = False
-  answer_in_thread: bool = False
-  simple_text: bool = False
-  command: bool = False
-  
-  @property
-  def json(self):
-    return dict(
-      urls=self.urls, image=self.images, videos=self.videos, audios=self.audios, gifs=self.gifs, role_mentions=self.role_mentions,
-      user_mentions=self.user_mentions, mention_everyone=self.mention_everyone, reply_to_message=self.reply_to_message,
-      thread_start=self.thread_start, answer_in_thread=self.answer_in_thread, simple_text=self.simple_text,
-      command=self.command
-    )
-    
-  def clear(self):
-    self.urls.clear()
-    self.images.clear()
-    self.videos.clear()
-    self.audios.clear()
-    self.gifs.clear()
-    self.role_mentions.clear()
-    self.user_mentions.clear()
+
+class MessageType:
+  SIMPLE_TEXT = 1 << 0
+  URL = 1 << 1
+  GIF = 1 << 2
+  IMAGE = 1 << 3
+  VIDEO = 1 << 4
+  AUDIO = 1 << 5
+  MENTION_EVERYONE = 1 << 6
+  POLL = 1 << 7
+  ROLE_MENTION = 1 << 8
+  STICKER = 1 << 9
+  COMMAND = 1 << 10
+  REPLY = 1 << 11
+  ANSWER_IN_THREAD = 1 << 12
+  THREAD_START = 1 << 13
+
+  NOT_SIMPLE = (
+    URL | GIF | IMAGE | VIDEO | AUDIO | STICKER | MENTION_EVERYONE | ROLE_MENTION | POLL | REPLY | ANSWER_IN_THREAD | THREAD_START
+  )
+
+  @staticmethod
+  @lru_cache(maxsize=None)
+  def names(mask: int) -> tuple[str, ...]:
+    return tuple(k.lower() for k, v in vars(MessageType).items() if k.isupper() and k != 'NOT_SIMPLE' and v & mask)
+
 
 class MessageData:
-  id: int
-  channel: int
-  author: int
-  guild: int
-  types = MessageTypes()
-  entities = MessageEntities()
+  __slots__ = (
+    'id', 'channel', 'author', 'guild', 'types', 'urls', 'images', 'videos', 'audios', 'gifs',
+    'role_mentions', 'user_mentions', 'reply_to_message'
+  )
 
   def __init__(self, message: Message):
     self.id = message.id
     self.channel = message.channel.id
     self.author = message.author.id
     self.guild = message.guild.id
-    
-  def clear(self):
-    self.entities.clear()
-    self.types.clear()
+    self.types = 0
+    self.urls = self.images = self.videos = self.audios = self.gifs = ()
+    self.role_mentions = self.user_mentions = ()
+    self.reply_to_message = None
+
+  @property
+  def type_names(self) -> tuple[str, ...]:
+    return MessageType.names(self.types)
 
   @property
   def json(self):
-    return dict(id=self.id, channel=self.channel, author=self.author, guild=self.guild, types=self.types.json, entities=self.entities.json)
-  
+    return dict(
+      id=self.id, channel=self.channel, author=self.author, guild=self.guild, types=self.type_names,
+      entities=dict(
+        urls=list(self.urls), images=list(self.images), videos=list(self.videos), audios=list(self.audios),
+        gifs=list(self.gifs), role_mentions=list(self.role_mentions), user_mentions=list(self.user_mentions),
+        mention_everyone=bool(self.types & MessageType.MENTION_EVERYONE), reply_to_message=self.reply_to_message,
+        thread_start=bool(self.types & MessageType.THREAD_START), answer_in_thread=bool(self.types & MessageType.ANSWER_IN_THREAD),
+        simple_text=bool(self.types & MessageType.SIMPLE_TEXT), command=bool(self.types & MessageType.COMMAND)
+      )
+    )
 
-class MessageAnalyzer:
-  URL_REGEX = re.compile(r"(https?://[^\s]+)", re.IGNORECASE)
 
-  IMAGE_EXT = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
-  VIDEO_EXT = {".mp4", ".mov", ".webm", ".mkv"}
-  AUDIO_EXT = {".mp3", ".wav", ".ogg", ".flac"}
-  GIF_EXT   = {".gif"}
+class MessageAnalyzer:
+  EXT_TYPES = {
+    'png': MessageType.IMAGE, 'jpg': MessageType.IMAGE, 'jpeg': MessageType.IMAGE, 'webp': MessageType.IMAGE, 'bmp': MessageType.IMAGE,
+    'mp4': MessageType.VIDEO, 'mov': MessageType.VIDEO, 'webm': MessageType.VIDEO, 'mkv': MessageType.VIDEO,
+    'mp3': MessageType.AUDIO, 'wav': MessageType.AUDIO, 'ogg': MessageType.AUDIO, 'flac': MessageType.AUDIO,
+    'gif': MessageType.GIF,
+  }
+  SLOTS = {
+    MessageType.URL: 'urls', MessageType.IMAGE: 'images', MessageType.VIDEO: 'videos',
+    MessageType.AUDIO: 'audios', MessageType.GIF: 'gifs',
+  }
+  # (url, extension, tenor-style "-gif-" suffix); falls back to a bare url when no known suffix ends it
+  URL_REGEX = re.compile(
+    r'(https?://(?:\S*?(?:\.(' + '|'.join(sorted(EXT_TYPES, key=len, reverse=True)) + r')|(-gif(?:-\S*)?))(?!\S)|\S+))',
+    re.IGNORECASE
+  )
 
   def __init__(self, message: Message, prefix: str = ''):
     self.message = message
     self.prefix = prefix
-    self.DATA = MessageData(message)
 
   def analyze(self) -> MessageData:
-    self._attachments()
-    self._stickers()
-    self._polls()
-    self._urls()
-    self._mentions()
-    self._reply()
-    self._thread_state()
-    self._simple_text()
-
-    return self.DATA
-  
-  def clear(self):
-    self.DATA.clear()
-  
-  @property
-  def json(self):
-    return self.DATA.json
-
-  def _attachments(self):
+    data = MessageData(self.message)
+    self._attachments(data)
+    self._stickers(data)
+    self._polls(data)
+    self._urls(data)
+    self._mentions(data)
+    self._reply(data)
+    self._thread_state(data)
+    self._simple_text(data)
+    return data
+
+  def _add(self, data: MessageData, kind: int, url: str):
+    data.types |= kind
+    slot = self.SLOTS[kind]
+    setattr(data, slot, getattr(data, slot) + (url,))
+
+  def _attachments(self, data: MessageData):
     for att in self.message.attachments:
-      ext = self._ext(att.filename)
+      kind = self.EXT_TYPES.get(att.filename.rsplit('.', 1)[-1].lower())
+      if kind: self._add(data, kind, att.url)
 
-      if ext in self.IMAGE_EXT:
-        self.DATA.types.add("image")
-        self.DATA.entities.images.add(att.url)
-
-      elif ext in self.VIDEO_EXT:
-        self.DATA.types.add("video")
-        self.DATA.entities.videos.add(att.url)
-
-      elif ext in self.AUDIO_EXT:
-        self.DATA.types.add("audio")
-        self.DATA.entities.audios.add(att.url)
-
-      elif ext in self.GIF_EXT:
-        self.DATA.types.add("gif")
-        self.DATA.entities.gifs.add(att.url)
-
-  def _stickers(self):
+  def _stickers(self, data: MessageData):
     if self.message.stickers:
-      self.DATA.types.add("stickers")
-
-  def _polls(self):
-    if getattr(self.message, "poll", None):
-      self.DATA.types.add("poll")
-
-  def _urls(self):
-    urls = self.URL_REGEX.findall(self.message.content)
-
-    for url in urls:
-      lower = url.lower()
-      uri = urlparse(lower)
-      if lower.endswith(".gif") or 'gif' in uri.path.split('-'):
-        self.DATA.types.add("gif")
-        self.DATA.entities.gifs.add(url)
-
-      elif any(lower.endswith(ext) for ext in self.IMAGE_EXT):
-        self.DATA.types.add("image")
-        self.DATA.entities.images.add(url)
-
-      elif any(lower.endswith(ext) for ext in self.VIDEO_EXT):
-        self.DATA.types.add("video")
-        self.entities["videos"].append(url)
-
-      elif any(lower.endswith(ext) for ext in self.AUDIO_EXT):
-        self.DATA.types.add("audio")
-        self.DATA.entities.audios.add(url)
-
-      else:
-        self.DATA.types.add('url')
-        self.DATA.entities.urls.add(url)
-
-  def _mentions(self):
-    self.DATA.entities.role_mentions = [r.id for r in self.message.role_mentions]
-    self.DATA.entities.user_mentions = [u.id for u in self.message.mentions]
-
+      data.types |= MessageType.STICKER
+
+  def _polls(self, data: MessageData):
+    if getattr(self.message, 'poll', None):
+      data.types |= MessageType.POLL
+
+  def _urls(self, data: MessageData):
+    for url, ext, gif in self.URL_REGEX.findall(self.message.content):
+      kind = MessageType.GIF if gif else self.EXT_TYPES[ext.lower()] if ext else MessageType.URL
+      self._add(data, kind, url)
+
+  def _mentions(self, data: MessageData):
+    if self.message.role_mentions:
+      data.role_mentions = tuple(r.id for r in self.message.role_mentions)
+      data.types |= MessageType.ROLE_MENTION
+    if self.message.mentions:
+      data.user_mentions = tuple(u.id for u in self.message.mentions)
     if self.message.mention_everyone:
-      self.DATA.entities.mention_everyone = True
-      self.DATA.types.add("mention_everyone")
+      data.types |= MessageType.MENTION_EVERYONE
 
-  def _reply(self):
+  def _reply(self, data: MessageData):
     ref = self.message.reference
     if ref and isinstance(ref.resolved, Message):
-      self.DATA.types.add("reply")
-      self.DATA.entities.reply_to_message = ref.resolved.id
+      data.types |= MessageType.REPLY
+      data.reply_to_message = ref.resolved.id
 
-  def _thread_state(self):
+  def _thread_state(self, data: MessageData):
     channel = self.message.channel
-
     if isinstance(channel, Thread):
-      self.DATA.entities.answer_in_thread = True
-      self.DATA.types.add("answer_in_thread")
-
+      data.types |= MessageType.ANSWER_IN_THREAD
       if channel.owner_id == self.message.author.id and self.message.id == channel.id:
-        self.DATA.entities.thread_start = True
-        self.DATA.types.add("thread_start")
-        
-  def _simple_text(self):
+        data.types |= MessageType.THREAD_START
+
+  def _simple_text(self, data: MessageData):
     if not self.message.content.strip(): return
     if self.message.content.startswith(self.prefix):
-      self.DATA.entities.command = True
-      self.DATA.types.add('command')
+      data.types |= MessageType.COMMAND
       return
-    if any([
-      self.message.attachments,
-      self.message.stickers,
-      self.message.embeds,
-      self.DATA.entities.urls,
-      self.DATA.entities.images,
-      self.DATA.entities.videos,
-      self.DATA.entities.audios,
-      self.DATA.entities.user_mentions,
-      self.DATA.entities.role_mentions,
-      self.DATA.entities.mention_everyone,
-      self.DATA.entities.reply_to_message,
-      self.DATA.entities.thread_start,
-      self.DATA.entities.answer_in_thread,
-      getattr(self.message, "poll", None)
-    ]): return
-    self.DATA.entities.simple_text = True
-    self.DATA.types.add('simple_text')
-
-  @staticmethod
-  def _ext(filename: str) -> str:
-    return "." + filename.lower().rsplit(".", 1)[-1]
+    if data.types & MessageType.NOT_SIMPLE or data.user_mentions or self.message.attachments or self.message.embeds: return
+    data.types |= MessageType.SIMPLE_TEXT
@@ -0,0 +1,104 @@
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from datetime import datetime as dt, timedelta
+from sqlalchemy import insert, delete
+from collections import OrderedDict
+from bot.utils import setup_logger
+from bot.models import MessageDelta
+import asyncio
+import time
+
+logger = setup_logger('MessageDeltaStore', filename='bot_message_deltas.log')
+
+
+class MessageDeltaStore:
+  """ Message id -> (author, XP delta), kept in a bounded LRU and persisted in batches """
+  def __init__(self, session_maker: async_sessionmaker[AsyncSession], maxsize: int = 5000, ttl: int = 604800, flush_interval: int = 5, evict_interval: int = 3600, **kwargs) -> None:
+    self.session_maker = session_maker
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.flush_interval = flush_interval
+    self.evict_interval = evict_interval
+    self.since = time.time()
+    self._cache: OrderedDict[int, tuple[int, int]] = OrderedDict()
+    self._dirty: dict[int, tuple[int, int]] = {}
+    self._removed: set[int] = set()
+    self._evicted = time.monotonic()
+    self._task: asyncio.Task = None
+
+  def _remember(self, message_id: int, entry: tuple[int, int]) -> None:
+    self._cache[message_id] = entry
+    self._cache.move_to_end(message_id)
+    while len(self._cache) > self.maxsize:
+      self._cache.popitem(last=False)
+
+  def tracks(self, created_at: dt) -> bool:
+    """ Whether a message without a record is known to have earned no XP """
+    return created_at.timestamp() >= max(self.since, time.time() - self.ttl)
+
+  def record(self, message_id: int, author: int, delta: int) -> None:
+    entry = (author, delta)
+    self._remember(message_id, entry)
+    self._removed.discard(message_id)
+    self._dirty[message_id] = entry
+
+  async def get(self, message_id: int) -> tuple[int, int] | None:
+    entry = self._cache.get(message_id) or self._dirty.get(message_id)
+    if entry:
+      self._remember(message_id, entry)
+      return entry
+    if message_id in self._removed: return None
+    async with self.session_maker() as session:
+      row = await MessageDelta.first(session, columns=['author', 'delta'], message_id=message_id)
+    if not row: return None
+    entry = (row.author, row.delta)
+    self._remember(message_id, entry)
+    return entry
+
+  async def pop(self, message_id: int) -> tuple[int, int] | None:
+    entry = await self.get(message_id)
+    self._cache.pop(message_id, None)
+    self._dirty.pop(message_id, None)
+    self._removed.add(message_id)
+    return entry
+
+  def start(self) -> None:
+    if self._task is None:
+      self._task = asyncio.create_task(self._worker())
+
+  async def stop(self) -> None:
+    if self._task is None: return
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+    self._task = None
+    await self.flush()
+
+  async def _worker(self) -> None:
+    while True:
+      await asyncio.sleep(self.flush_interval)
+      await self.flush()
+
+  async def flush(self) -> None:
+    dirty, removed = self._dirty, self._removed
+    self._dirty, self._removed = {}, set()
+    evict = time.monotonic() - self._evicted >= self.evict_interval
+    if not (dirty or removed or evict): return
+    try:
+      async with self.session_maker() as session:
+        stale = set(dirty) | removed
+        if stale:
+          await session.execute(delete(MessageDelta).where(MessageDelta.message_id.in_(stale)))
+        if dirty:
+          rows = [dict(message_id=k, author=author, delta=delta) for k, (author, delta) in dirty.items()]
+          await session.execute(insert(MessageDelta).values(rows))
+        if evict:
+          expired = await session.execute(delete(MessageDelta).where(MessageDelta.created < dt.now() - timedelta(seconds=self.ttl)))
+          self._evicted = time.monotonic()
+          logger.info(f'Evicted {expired.rowcount} expired message deltas')
+        await session.commit()
+    except Exception:
+      self._dirty = {**{k: v for k, v in dirty.items() if k not in self._removed}, **self._dirty}
+      self._removed |= removed - set(self._dirty)
+      logger.exception(f'Failed to persist {len(dirty)} message deltas')
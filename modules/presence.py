@@ -0,0 +1,34 @@
+from discord import Guild, VoiceState
+import time
+
+
+class VoicePresence:
+  """ Member id -> (voice channel id, join time), fed by gateway voice state updates """
+  def __init__(self) -> None:
+    self._members: dict[int, tuple[int, float]] = {}
+
+  def __len__(self):
+    return len(self._members)
+
+  def __contains__(self, member_id):
+    return member_id in self._members
+
+  def seed(self, guild: Guild) -> None:
+    now = time.time()
+    for channel in (*guild.voice_channels, *guild.stage_channels):
+      for member_id in channel.voice_states:
+        self._members.setdefault(member_id, (channel.id, now))
+
+  def update(self, member_id: int, before: VoiceState, after: VoiceState) -> None:
+    if after.channel is None:
+      self._members.pop(member_id, None)
+    elif before.channel != after.channel:
+      self._members[member_id] = (after.channel.id, time.time())
+
+  def channel(self, member_id: int) -> int | None:
+    entry = self._members.get(member_id)
+    return entry[0] if entry else None
+
+  def duration(self, member_id: int) -> float:
+    entry = self._members.get(member_id)
+    return time.time() - entry[1] if entry else 0.0
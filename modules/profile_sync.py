@@ -0,0 +1,67 @@
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.utils import setup_logger
+from bot.models import GuildUser
+import asyncio
+import time
+
+logger = setup_logger('ProfileSync', filename='bot_profile_sync.log')
+
+
+class ProfileSync:
+  """ Debounced write-behind of member profile changes, flushed as one bulk update """
+  def __init__(self, session_maker: async_sessionmaker[AsyncSession], debounce: float = 10, flush_interval: float = 2, max_pending: int = 1000, **kwargs) -> None:
+    self.session_maker = session_maker
+    self.debounce = debounce
+    self.flush_interval = flush_interval
+    self.max_pending = max_pending
+    self._pending: dict[int, dict] = {}
+    self._due: dict[int, float] = {}
+    self._task: asyncio.Task = None
+
+  @staticmethod
+  def diff(before, after) -> dict:
+    """ Profile fields that differ between two Member/User snapshots """
+    old, new = GuildUser.profile_values(before), GuildUser.profile_values(after)
+    return {k: v for k, v in new.items() if k in old and old[k] != v}
+
+  def record(self, discord_id: int, changes: dict) -> None:
+    if not changes: return
+    self._pending.setdefault(discord_id, {}).update(changes)
+    self._due[discord_id] = time.monotonic() + self.debounce
+
+  def start(self) -> None:
+    if self._task is None:
+      self._task = asyncio.create_task(self._worker())
+
+  async def stop(self) -> None:
+    if self._task is None: return
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+    self._task = None
+    await self.flush(everything=True)
+
+  async def _worker(self) -> None:
+    while True:
+      await asyncio.sleep(self.flush_interval)
+      await self.flush(everything=len(self._pending) >= self.max_pending)
+
+  async def flush(self, everything: bool = False) -> int:
+    now = time.monotonic()
+    ready = [k for k, due in self._due.items() if everything or due <= now]
+    if not ready: return 0
+    batch = {k: self._pending.pop(k) for k in ready}
+    for k in ready: self._due.pop(k)
+    try:
+      async with self.session_maker() as session:
+        await GuildUser.bulk_update(session, batch, key='id', overwrite=True)
+    except Exception:
+      for discord_id, changes in batch.items():
+        self._pending[discord_id] = {**changes, **self._pending.get(discord_id, {})}
+        self._due.setdefault(discord_id, now)
+      logger.exception(f'Failed to sync profiles of {len(batch)} members')
+      return 0
+    logger.info(f'Synced {len(batch)} member profiles')
+    return len(batch)
@@ -0,0 +1,92 @@
+from typing import Awaitable, Callable
+from bot.utils import setup_logger
+from discord import Guild
+import asyncio
+import time
+
+logger = setup_logger('Startup', filename='bot_startup.log')
+
+
+class RateBudget:
+  """ Token bucket shared by every job that calls the Discord REST API """
+  def __init__(self, rate: int = 5, per: float = 1.0) -> None:
+    self.rate = rate
+    self.per = per
+    self._tokens = float(rate)
+    self._updated = time.monotonic()
+    self._lock = asyncio.Lock()
+
+  async def acquire(self) -> None:
+    async with self._lock:
+      while True:
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.per)
+        self._updated = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        await asyncio.sleep((1 - self._tokens) * self.per / self.rate)
+
+
+class Phase:
+  __slots__ = ('name', 'handler', 'per_guild', 'timings', 'errors')
+
+  def __init__(self, name: str, handler: Callable[..., Awaitable], per_guild: bool = True) -> None:
+    self.name = name
+    self.handler = handler
+    self.per_guild = per_guild
+    self.timings: list[float] = []
+    self.errors = 0
+
+
+class Startup:
+  """ Runs the cogs' ready-time phases for every guild concurrently under one concurrency limit """
+  def __init__(self, concurrency: int = 4, rate: int = 5, per: float = 1.0, **kwargs) -> None:
+    self.concurrency = concurrency
+    self.budget = RateBudget(rate, per)
+    self.phases: dict[str, Phase] = {}
+    self._running = False
+
+  def add_phase(self, name: str, handler: Callable[..., Awaitable], per_guild: bool = True) -> None:
+    """ Handler is called with a guild for per-guild phases and without arguments otherwise """
+    self.phases[name] = Phase(name, handler, per_guild)
+
+  def remove_phase(self, name: str) -> None:
+    self.phases.pop(name, None)
+
+  async def _job(self, sem: asyncio.Semaphore, phase: Phase, guild: Guild = None) -> None:
+    async with sem:
+      started = time.perf_counter()
+      try:
+        await (phase.handler(guild) if phase.per_guild else phase.handler())
+      except Exception:
+        phase.errors += 1
+        logger.exception(f'Startup phase {phase.name} failed{f" for guild {guild.id}" if guild else ""}')
+      phase.timings.append(time.perf_counter() - started)
+
+  async def run(self, guilds: list[Guild]) -> None:
+    if self._running: return
+    self._running = True
+    started = time.perf_counter()
+    phases = list(self.phases.values())
+    try:
+      sem = asyncio.Semaphore(self.concurrency)
+      for phase in phases:
+        phase.timings, phase.errors = [], 0
+      await asyncio.gather(*(
+        self._job(sem, phase, guild)
+        for phase in phases
+        for guild in (guilds if phase.per_guild else [None])
+      ))
+    finally:
+      self._running = False
+    self.report(phases, len(guilds), time.perf_counter() - started)
+
+  def report(self, phases: list[Phase], guilds: int, elapsed: float) -> None:
+    logger.info(f'Startup finished in {elapsed:.2f}s for {guilds} guilds')
+    for phase in phases:
+      if not phase.timings: continue
+      logger.info(
+        f'  {phase.name}: {len(phase.timings)} jobs, total {sum(phase.timings):.2f}s, '
+        f'slowest {max(phase.timings):.2f}s, errors {phase.errors}'
+      )
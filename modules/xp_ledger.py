@@ -0,0 +1,92 @@
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.models.xp_history import Source
+from bot.utils import setup_logger
+from .identity import IdentityMap
+from bot.models import GuildUser
+import asyncio
+
+logger = setup_logger('XPLedger', filename='bot_xp_ledger.log')
+
+
+class XPLedger:
+  """ Write-behind buffer for XP grants, flushed as bulk statements """
+  _CLOSE = object()
+
+  def __init__(self, session_maker: async_sessionmaker[AsyncSession], identities: IdentityMap = None, flush_interval: int = 500, max_batch: int = 200, max_pending: int = 20000, max_backoff: float = 30, **kwargs) -> None:
+    self.session_maker = session_maker
+    self.identities = identities
+    self.flush_interval = flush_interval / 1000
+    self.max_batch = max_batch
+    self.max_pending = max_pending
+    self.max_backoff = max_backoff
+    self._failed: list[tuple] = [] # grants of the last failed flush, retried after `_backoff` seconds
+    self._backoff = 0.0
+    self.queue: asyncio.Queue = asyncio.Queue()
+    self._task: asyncio.Task = None
+
+  def grant(self, discord_id: int, source: str, delta: int, multiplier: str = None) -> None:
+    if not delta: return
+    self.queue.put_nowait((discord_id, Source(source), int(delta), multiplier))
+
+  def start(self) -> None:
+    if self._task is None:
+      self._task = asyncio.create_task(self._worker())
+
+  async def stop(self) -> None:
+    if self._task is None: return
+    self.queue.put_nowait(self._CLOSE)
+    await self._task
+    self._task = None
+
+  async def _collect(self) -> tuple[list, bool]:
+    loop = asyncio.get_running_loop()
+    batch, self._failed = self._failed, []
+    retrying = bool(batch)
+    if not retrying:
+      item = await self.queue.get()
+      if item is self._CLOSE: return [], True
+      batch = [item]
+    deadline = loop.time() + (self._backoff if retrying else self.flush_interval)
+    while retrying or len(batch) < self.max_batch:
+      timeout = deadline - loop.time()
+      if timeout <= 0: break
+      try:
+        item = await asyncio.wait_for(self.queue.get(), timeout)
+      except asyncio.TimeoutError:
+        break
+      if item is self._CLOSE: return batch, True
+      batch.append(item)
+    return batch, False
+
+  async def _worker(self) -> None:
+    closing = False
+    while not closing:
+      batch, closing = await self._collect()
+      await self.flush(batch)
+    rest, self._failed = self._failed, []
+    while not self.queue.empty():
+      item = self.queue.get_nowait()
+      if item is not self._CLOSE: rest.append(item)
+    await self.flush(rest)
+    if self._failed:
+      logger.error(f'Lost {len(self._failed)} XP grants on shutdown')
+
+  async def flush(self, batch: list[tuple]) -> dict[int, int]:
+    if not batch: return {}
+    try:
+      async with self.session_maker() as session:
+        known = self.identities.uids({discord_id for discord_id, *_ in batch}) if self.identities else None
+        totals = await GuildUser.grant_xp(session, batch, known)
+    except Exception:
+      self._backoff = min(self.max_backoff, self._backoff * 2 or self.flush_interval)
+      self._failed = batch[-self.max_pending:]
+      lost = len(batch) - len(self._failed)
+      logger.exception(f'Failed to flush {len(batch)} XP grants, retrying in {self._backoff:.1f}s{f", dropped {lost} oldest" if lost else ""}')
+      return {}
+    self._backoff = 0.0
+    dropped = {discord_id for discord_id, *_ in batch} - set(totals)
+    if dropped:
+      logger.warning(f'Dropped XP grants for unknown members: {", ".join(map(str, dropped))}')
+    if self.identities: self.identities.update_xp(totals)
+    logger.info(f'Flushed {len(batch)} XP grants for {len(totals)} users')
+    return totals
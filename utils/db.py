@@ -1,12 +1,16 @@
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.models.base import UNIT_OF_WORK, run_commit_hooks
 
 async def with_session(bot, handler, *args, **kwargs):
   session_maker: async_sessionmaker[AsyncSession] = bot.db_sessionmaker
   async with session_maker() as session:
+    session.info[UNIT_OF_WORK] = True
     try:
       result = await handler(session, *args, **kwargs)
       await session.commit()
+      run_commit_hooks(session, committed=True)
       return result
     except Exception:
       await session.rollback()
+      run_commit_hooks(session, committed=False)
       raise
@@ -1,5 +1,6 @@
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from bot.models.base import Base
+from .migrations import migrate
 import os
 
 
@@ -17,6 +18,7 @@ session_maker = async_sessionmaker(
 async def create_db():
   async with engine.begin() as conn:
     await conn.run_sync(Base.metadata.create_all)
+    await migrate(conn)
   
 async def drop_db():
   async with engine.begin() as conn:
@@ -0,0 +1,71 @@
+from bot.models import GuildUser, XPHistory, ServerRole, UserWatchDog, SchemaVersion, Command
+from sqlalchemy import Index, Table, select, insert, func, inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.schema import CreateColumn
+from .logger import setup_logger
+
+logger = setup_logger('Migrations', filename='bot_migrations.log')
+
+
+def _index(table: Table, name: str) -> Index:
+  return next(idx for idx in table.indexes if idx.name == name)
+
+def create_index(table: Table, name: str):
+  async def step(conn: AsyncConnection):
+    await conn.run_sync(_index(table, name).create, checkfirst=True)
+  return step
+
+def add_column(table: Table, name: str):
+  async def step(conn: AsyncConnection):
+    existing = await conn.run_sync(lambda c: {col['name'] for col in inspect(c).get_columns(table.name)})
+    if name in existing: return
+    column = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+    await conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column}'))
+  return step
+
+def modify_column(table: Table, name: str):
+  async def step(conn: AsyncConnection):
+    if conn.dialect.name != 'mysql': return # MODIFY COLUMN is MySQL syntax
+    column = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+    await conn.execute(text(f'ALTER TABLE {table.name} MODIFY COLUMN {column}'))
+  return step
+
+
+MIGRATIONS = [
+  (1, 'Index lookup columns', [
+    create_index(GuildUser.__table__, 'ix_users_id'),
+    create_index(XPHistory.__table__, 'ix_experience_history_uuid_created'),
+    create_index(ServerRole.__table__, 'ix_server_roles_guild_id'),
+    create_index(UserWatchDog.__table__, 'ix_users_watchdog_uuid'),
+  ]),
+  (2, 'Command cooldown formula', [
+    add_column(Command.__table__, 'cooldown_formula'),
+  ]),
+  (3, 'Command response cache', [
+    add_column(Command.__table__, 'cache_ttl'),
+    add_column(Command.__table__, 'cache_scope'),
+  ]),
+  (4, 'Command change tracking', [
+    add_column(Command.__table__, 'updated'),
+  ]),
+  (5, 'Command concurrency limits', [
+    add_column(Command.__table__, 'max_concurrency'),
+    add_column(Command.__table__, 'queue_depth'),
+  ]),
+  (6, 'Microsecond command change tracking', [
+    modify_column(Command.__table__, 'updated'),
+  ]),
+]
+
+
+async def migrate(conn: AsyncConnection) -> int:
+  await conn.run_sync(SchemaVersion.__table__.create, checkfirst=True)
+  current = (await conn.execute(select(func.max(SchemaVersion.version)))).scalar() or 0
+  for version, description, steps in MIGRATIONS:
+    if version <= current: continue
+    for step in steps:
+      await step(conn)
+    await conn.execute(insert(SchemaVersion).values(version=version, description=description))
+    logger.info(f'Applied migration {version}: {description}')
+    current = version
+  return current
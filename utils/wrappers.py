@@ -1,14 +1,18 @@
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.models.base import UNIT_OF_WORK, run_commit_hooks
 
 def sessioned(func):
   async def wrapper(self, ctx, *args, **kwargs):
     sessionm: async_sessionmaker[AsyncSession] = self.bot.db_sessionmaker
     async with sessionm() as session:
+      session.info[UNIT_OF_WORK] = True
       try:
         result = await func(self, ctx, session, *args, **kwargs)
         await session.commit()
+        run_commit_hooks(session, committed=True)
         return result
       except Exception:
         await session.rollback()
+        run_commit_hooks(session, committed=False)
         raise
   return wrapper